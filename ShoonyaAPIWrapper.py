@@ -1,4 +1,6 @@
+import concurrent.futures
 import json
+import time
 from typing import Any
 import logging
 
@@ -6,7 +8,14 @@ import pandas as pd
 from PySide6.QtCore import Slot, QObject, Signal, QThread
 
 from Wrapperinterface import WrapperInterface
-from api_helper import ShoonyaApiPy
+from NorenRestApiPy.NorenApi import FeedType
+
+from api_helper import ShoonyaApiPy, OrderBasket
+from bar_aggregator import BarAggregator
+from chain_snapshot import ChainSnapshot
+from rest_client import RestClient
+from slot_profiler import profiler
+from tick_store import TickStore
 
 class ShoonyaAPIWrapper(WrapperInterface, QObject):
     logger = logging.getLogger("ShoonyaWrapper")
@@ -15,7 +24,7 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
     # dict -> the entire dictionary received as a result of login call to Shoonya API
     on_login_result = Signal(bool, dict)
 
-    on_position_result = Signal(bool, pd.DataFrame)
+    on_position_result = Signal(bool, object)
 
 
     """
@@ -30,12 +39,49 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
     """
     on_positions_price_updates = Signal(int, float)
 
-    def __init__(self, api: ShoonyaApiPy, parent=None):
+    """
+    int -> the token for which the depth is received
+    dict -> the depth feed message, only the changed levels are present in it
+    """
+    on_depth_updates = Signal(int, dict)
+
+    """
+    dict -> every feed message as received, fired on the websocket thread
+    """
+    on_tick = Signal(object)
+
+    """
+    list -> the place order response of each leg of the basket, None for a leg which failed
+    """
+    on_basket_result = Signal(list)
+
+    # the REST responses arrive on the RestClient workers, these bring them back to the wrapper's thread
+    _login_received = Signal(object)
+    _positions_received = Signal(object)
+
+    def __init__(self, api: ShoonyaApiPy, parent=None, bars: BarAggregator = None, snapshot: ChainSnapshot = None):
         super().__init__(parent=parent)
         self.api = api
         self.active_subs = set()
         self.positions_subs = set()
+        self.depth_subs = set()
         self._has_error = False
+        # intraday bars of every subscribed token, written from the websocket thread
+        self.bars = bars if bars is not None else BarAggregator()
+        # the day's ticks are recorded to disk once logged in
+        self.tick_store: TickStore = None
+        # token -> the last feed time, a tick without one is recorded at the time of the previous tick of the token
+        self._feed_times = {}
+        # the last known price and OI of every token, shown by the chains until the live ticks arrive
+        self.snapshot = snapshot
+        # login, positions and quotes are fetched asynchronously, the wrapper thread is never blocked on them
+        self.rest = RestClient(api)
+        # the positions call in flight, its result is processed once however many times positions were requested
+        self._positions_future = None
+        # baskets are placed on their own pool, a leg waiting on the broker never holds up the wrapper's thread
+        self._basket_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='Basket')
+        self._login_received.connect(self._on_login_done)
+        self._positions_received.connect(self._on_positions_received)
 
     @Slot(Any)
     def onLogin(self, data: Any) -> None:
@@ -45,13 +91,24 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
         :param data: the required login data dictionary
         :return: None
         """
-        ret = self.api.login(userid=data['user'], password=data['password'], twoFA=data['totp'],
-                       vendor_code=data['vc'], imei=data['imei'], api_secret=data['apikey'])
+        future = self.rest.login(userid=data['user'], password=data['password'], twoFA=data['totp'],
+                                 vendor_code=data['vc'], imei=data['imei'], api_secret=data['apikey'])
+        future.add_done_callback(self._login_received.emit)
+
+    @Slot(object)
+    def _on_login_done(self, future):
+        try:
+            ret = future.result()
+        except Exception as exc:
+            self.logger.error(f'Login failed -> {exc}')
+            ret = None
 
         # if login is success, start UI update in case option chain is already selected
         self.on_login_result.emit(ret is not None, ret)
 
         if ret is not None:
+            if self.tick_store is None:
+                self.tick_store = TickStore()
             self.api.start_websocket(subscribe_callback=self._on_subscribe,
                                      order_update_callback=self._on_order_update,
                                      socket_open_callback=self._on_socket_open,
@@ -62,6 +119,18 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
     def onLogout(self):
         self.api.close_websocket()
         self.active_subs = None
+        self.depth_subs = set()
+
+    def close(self):
+        """
+        Write out the pending ticks, to be called when the application quits
+        :return: None
+        """
+        if self.tick_store is not None:
+            self.tick_store.close()
+            self.tick_store = None
+        self.rest.close()
+        self._basket_executor.shutdown(wait=False)
 
     @Slot(list)
     def on_subscribe_instruments(self, data: list) -> None:
@@ -72,13 +141,13 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
         :return: None
         """
         if self.active_subs is None:
-            self.active_subs = set(data)
-        else:
-            self.active_subs.update(data)
+            self.active_subs = set()
 
-        # we are assuming that multiple subscription won't actually result in multiple calls for same token
-        # todo: verify the above statement
-        self.api.subscribe(list(self.active_subs))
+        # subscribe only to the instruments which are not already subscribed
+        new_subs = [x for x in dict.fromkeys(data) if x not in self.active_subs]
+        self.active_subs.update(new_subs)
+        if len(new_subs) > 0:
+            self.api.subscribe(new_subs)
 
     @Slot(list)
     def on_unsubscribe_instrument(self, data: list) -> None:
@@ -92,11 +161,33 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
         for x in data:
             if x in self.positions_subs:
                 self.positions_subs.remove(x)
-            else:
-                self.active_subs.remove(x)
+            elif self.active_subs is not None:
+                self.active_subs.discard(x)
+
+    @Slot(list)
+    def on_subscribe_depth(self, data: list) -> None:
+        """
+        Subscribe to market depth updates of the instruments. The signal @{on_depth_updates} is fired for every
+        depth update received
+        :param data: The list of the instruments to subscribe to
+        :return: None
+        """
+        self.depth_subs.update(data)
+        self.api.subscribe(data, feed_type=FeedType.SNAPQUOTE)
+
+    @Slot(list)
+    def on_unsubscribe_depth(self, data: list) -> None:
+        """
+        Remove the market depth subscription for the instruments contained in data
+        :param data: The list of the instruments to unsubscribe
+        :return: None
+        """
+        self.api.unsubscribe(data, feed_type=FeedType.SNAPQUOTE)
+        self.depth_subs.difference_update(data)
 
     def _on_subscribe(self, message):
         print(message)
+        self.on_tick.emit(message)
         token = int(message['tk'])
         ltp = ""
         if 'lp' in message:
@@ -108,14 +199,30 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
         except:
             pass
 
+        feed_time = message.get('ft')
+        if feed_time:
+            self._feed_times[token] = feed_time
+        else:
+            feed_time = self._feed_times.get(token)
+
+        if 'lp' in message or 'v' in message or 'oi' in message:
+            if self.tick_store is not None:
+                # the local clock is used only when not even the first tick of the token had a feed time
+                self.tick_store.append(token, feed_time or time.time(), message.get('lp'), message.get('v'),
+                                       message.get('oi'))
+            if self.snapshot is not None:
+                self.snapshot.update(token, message.get('lp'), message.get('oi'), feed_time)
+
         if ltp != "":
+            self.bars.on_tick(token, float(ltp), message.get('v'), feed_time)
             self.on_price_updates.emit(token, float(ltp), is_banned)
 
             # fire the signal again in case this token is in positions.
             if message['tk'] in self.positions_subs:
                 self.on_positions_price_updates.emit(token, float(ltp))
-        #else:
-            #self.onDepthUpdate
+
+        if message['t'] in ('dk', 'df'):
+            self.on_depth_updates.emit(token, message)
 
     def _on_order_update(self, message):
         self.logger.info(f'Received order update -> {message}')
@@ -123,8 +230,10 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
     def _on_socket_open(self):
         print("web socket opened")
         # if there was an error and current subscription is not empty, re-subscribe to get updates.
-        if self._has_error and len(self.active_subs) > 0:
-            self.on_subscribe_instruments(list(self.active_subs))
+        if self._has_error and self.active_subs is not None and len(self.active_subs) > 0:
+            self.api.subscribe(list(self.active_subs))
+        if self._has_error and len(self.depth_subs) > 0:
+            self.on_subscribe_depth(list(self.depth_subs))
 
     def _on_socket_close(self):
         self.logger.info(f'Socket closed')
@@ -148,29 +257,36 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
 
     def _prepare_subscription(self, positions_frame) -> []:
         # performing auto subscription of tokens for updates
-        if len(self.positions_subs) > 0:
-            # check if these tokens are still present in the data
-            new_positions = set(positions_frame['token'].values)
-            # find if these are already subscribed
-            diff = self.positions_subs - new_positions
-            # update the positions
-            self.positions_subs.difference_update(new_positions)
-            # remove the olds
-            self.on_unsubscribe_instrument(list(diff))
-        else:
-            self.positions_subs = set(positions_frame['token'].values)
+        new_positions = set(positions_frame['token'].values)
+        # the positions which are closed since the last refresh are unsubscribed, the open ones stay subscribed
+        closed = self.positions_subs - new_positions
+        self.positions_subs = new_positions
+        if len(closed) > 0:
+            self.on_unsubscribe_instrument(self._get_subscription_list('NFO', closed))
 
-        new_subs = None
-        if self.active_subs is not None:
-            new_subs = self.positions_subs - self.active_subs
-        else:
-            new_subs = self.positions_subs
-
-        return self._get_subscription_list('NFO', new_subs)
+        # subscribe only to the ones which are not already subscribed, e.g. by an open chain
+        subscribed = self.active_subs if self.active_subs is not None else set()
+        return [x for x in self._get_subscription_list('NFO', new_positions) if x not in subscribed]
 
     @Slot()
     def on_get_positions(self):
-        resp = self.api.get_positions()
+        """
+        Fetch the positions, the signal @{on_position_result} is emitted once they are received. A call made while
+        the previous one is still in flight is ignored, the positions are emitted once for both.
+        :return: None
+        """
+        if self._positions_future is not None and not self._positions_future.done():
+            return
+        self._positions_future = self.rest.positions()
+        self._positions_future.add_done_callback(self._positions_received.emit)
+
+    @Slot(object)
+    def _on_positions_received(self, future):
+        try:
+            resp = future.result()
+        except Exception as exc:
+            self.logger.info(f'Get positions failed -> {exc}')
+            resp = None
         self.logger.info(f'Get positions result = {resp}')
         df = pd.DataFrame()
         if resp is not None:
@@ -189,10 +305,37 @@ class ShoonyaAPIWrapper(WrapperInterface, QObject):
             df['Exchange'] = positions['exch']
             df['Type'] = positions['instname']
             df['Token'] = positions['token']
+            df['TradingSymbol'] = positions['tsym']
+            df['Product'] = positions['prd']
 
             new_subs = self._prepare_subscription(positions[positions['instname'].isin(['OPTIDX', 'OPTSTK'])])
             self.logger.info(f'Subscribing for tokens: {new_subs}')
             if new_subs is not None and len(new_subs) > 0:
                 self.on_subscribe_instruments(list(new_subs))
 
-        self.on_position_result.emit(resp is not None, df)
\ No newline at end of file
+        self.on_position_result.emit(resp is not None, df)
+
+    @Slot(object)
+    def on_place_basket(self, basket: OrderBasket):
+        """
+        Place all the legs of the basket in the background. The signal @{on_basket_result} is emitted once every leg
+        has returned
+        :param basket: the basket to be placed
+        :return: None
+        """
+        legs = len(basket)
+        future = self._basket_executor.submit(self.api.place_basket, basket)
+        future.add_done_callback(lambda done: self._on_basket_done(done, legs))
+
+    def _on_basket_done(self, future, legs: int):
+        try:
+            result = future.result()
+        except Exception as exc:
+            self.logger.error(f'Basket failed -> {exc}')
+            result = [None] * legs
+        self.logger.info(f'Basket placed, {sum(r is not None for r in result)} of {len(result)} legs accepted')
+        self.on_basket_result.emit(result)
+
+
+# wraps the slots and callbacks with timing when profiling is enabled, nothing is done otherwise
+profiler.instrument(ShoonyaAPIWrapper)
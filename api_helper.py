@@ -1,10 +1,18 @@
 from NorenRestApiPy.NorenApi import NorenApi
 import time
 import concurrent.futures
+import logging
+
+import numpy as np
 
 api = None
+logger = logging.getLogger("ShoonyaApiPy")
 
 class Order:
+    # orders are created in bulk for multi leg baskets, keep them free of a per instance __dict__
+    __slots__ = ('buy_or_sell', 'product_type', 'exchange', 'tradingsymbol', 'quantity', 'discloseqty',
+                 'price_type', 'price', 'trigger_price', 'retention', 'remarks', 'order_id')
+
     def __init__(self, buy_or_sell: str = None, product_type: str = None,
                  exchange: str = None, tradingsymbol: str = None,
                  price_type: str = None, quantity: int = None,
@@ -22,13 +30,15 @@ class Order:
         self.trigger_price = trigger_price
         self.retention = retention
         self.remarks = remarks
-        self.order_id = None
+        self.order_id = order_id
 
 
 class BuyOrder(Order):
     """
     Use this to produce a Limit Buy Order for an Option.
     """
+    __slots__ = ()
+
     def __init__(self, tradingSymbol: str, price: float, qty : int = 0):
         super().__init__(tradingsymbol=tradingSymbol, exchange='NFO',
                          product_type="M",
@@ -38,6 +48,8 @@ class BuyOrderMarket(Order):
     """
     Use this to produce a Market Buy Order for an Option.
     """
+    __slots__ = ()
+
     def __init__(self, tradingSymbol: str, qty: int = 0):
         super().__init__(tradingsymbol=tradingSymbol, exchange='NFO',
                          product_type="M",
@@ -49,6 +61,8 @@ class SellOrder(Order):
     """
     Use this to produce a Limit SELL Order for an Option.
     """
+    __slots__ = ()
+
     def __init__(self, tradingSymbol: str, price: float, qty: int = 0):
         super().__init__(tradingsymbol=tradingSymbol, exchange='NFO', product_type="M",
                          buy_or_sell='S', price_type='LMT', price=price, quantity=qty,
@@ -58,10 +72,94 @@ class SellOrderMarket(Order):
     """
     Use this to produce a Market SELL Order for an Option.
     """
+    __slots__ = ()
+
     def __init__(self, tradingSymbol: str, qty: int = 0):
         super().__init__(tradingsymbol=tradingSymbol, exchange='NFO', product_type="M",
                          buy_or_sell='S', price_type='MKT', price=0, quantity=qty,
                          remarks="Py_Sell_MKT")
+
+
+class OrderBasket:
+    """
+    Use this to produce a multi leg basket (strangles across a chain, exit all positions etc.).
+    The legs are kept as parallel NumPy columns and validated in one pass, an Order is only created for a leg
+    when the basket is iterated for submission.
+    """
+    __slots__ = ('tradingsymbol', 'quantity', 'buy_or_sell', 'price', 'exchange', 'product_type', 'price_type',
+                 'retention', 'remarks')
+
+    def __init__(self, tradingsymbol, quantity, buy_or_sell, price=0.0, exchange='NFO', product_type='M',
+                 price_type='MKT', retention: str = 'DAY', remarks: str = "Py_Basket"):
+        """
+        Every column other than tradingsymbol may be given as a scalar, which is then applied to all the legs.
+        :raises ValueError: if the columns don't line up or any of the legs is invalid
+        """
+        self.tradingsymbol = np.asarray(tradingsymbol, dtype=object).ravel()
+        legs = (self.tradingsymbol.size,)
+        # broadcast_to raises ValueError if a column does not match the number of legs
+        self.quantity = np.broadcast_to(np.asarray(quantity, dtype=np.int64), legs).copy()
+        self.buy_or_sell = np.broadcast_to(np.asarray(buy_or_sell, dtype=object), legs).copy()
+        self.price = np.broadcast_to(np.asarray(price, dtype=np.float64), legs).copy()
+        self.exchange = np.broadcast_to(np.asarray(exchange, dtype=object), legs).copy()
+        self.product_type = np.broadcast_to(np.asarray(product_type, dtype=object), legs).copy()
+        self.price_type = np.broadcast_to(np.asarray(price_type, dtype=object), legs).copy()
+        self.retention = retention
+        self.remarks = remarks
+        self._validate()
+
+    def _validate(self):
+        invalid = ~self.tradingsymbol.astype(bool)
+        invalid |= self.quantity <= 0
+        invalid |= ~np.isin(self.buy_or_sell, ('B', 'S'))
+        invalid |= ~np.isin(self.price_type, ('MKT', 'LMT'))
+        invalid |= (self.price_type == 'LMT') & (self.price <= 0)
+        if invalid.any():
+            raise ValueError(f'Invalid basket legs at {np.flatnonzero(invalid).tolist()}')
+
+    @classmethod
+    def from_chain(cls, chain, rows, option_type, buy_or_sell, lot_size: int, lots=1, **kwargs):
+        """
+        Build the legs straight from the option chain rows (see ShoonyaWindow._build_option_chain)
+        :param chain: the option chain data frame with CE_TradingSymbol and PE_TradingSymbol columns
+        :param rows: the row positions of the legs in the chain
+        :param option_type: "CE" or "PE" for all legs, or one value per leg
+        :param buy_or_sell: "B" or "S" for all legs, or one value per leg
+        :param lot_size: the lot size of the underlying
+        :param lots: the number of lots for all legs, or one value per leg
+        :return: the basket
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        ce_symbols = chain['CE_TradingSymbol'].values[rows]
+        pe_symbols = chain['PE_TradingSymbol'].values[rows]
+        symbols = np.where(np.asarray(option_type) == 'CE', ce_symbols, pe_symbols)
+        return cls(symbols, np.asarray(lots, dtype=np.int64) * lot_size, buy_or_sell, **kwargs)
+
+    @classmethod
+    def exit_positions(cls, positions, **kwargs):
+        """
+        Build the legs that square off every open position
+        :param positions: the positions data frame (see ShoonyaAPIWrapper.on_get_positions)
+        :return: the basket, empty if there is no open position
+        """
+        qty = positions['Qty'].values.astype(np.int64)
+        is_open = qty != 0
+        return cls(positions['TradingSymbol'].values[is_open], np.abs(qty[is_open]),
+                   np.where(qty[is_open] > 0, 'S', 'B'), exchange=positions['Exchange'].values[is_open],
+                   product_type=positions['Product'].values[is_open], **kwargs)
+
+    def __len__(self):
+        return self.tradingsymbol.size
+
+    def __iter__(self):
+        for i in range(self.tradingsymbol.size):
+            yield self.order(i)
+
+    def order(self, leg: int) -> Order:
+        return Order(buy_or_sell=self.buy_or_sell[leg], product_type=self.product_type[leg],
+                     exchange=self.exchange[leg], tradingsymbol=self.tradingsymbol[leg],
+                     price_type=self.price_type[leg], quantity=int(self.quantity[leg]),
+                     price=float(self.price[leg]), retention=self.retention, remarks=self.remarks)
 # print(ret)
 
 
@@ -78,23 +176,27 @@ class ShoonyaApiPy(NorenApi):
         global api
         api = self
 
-    def place_basket(self, orders):
-
-        resp_err = 0
-        resp_ok = 0
-        result = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-
-            future_to_url = {executor.submit(self.place_order, order): order for order in orders}
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-            try:
-                result.append(future.result())
-            except Exception as exc:
-                print(exc)
-                resp_err = resp_err + 1
-            else:
-                resp_ok = resp_ok + 1
+    def place_basket(self, orders, max_workers: int = 10):
+        """
+        Place all the orders concurrently. order_id of each order is set from the response when it is accepted.
+        :param orders: an OrderBasket or any iterable of Order
+        :param max_workers: the number of orders in flight at a time
+        :return: the list of responses in the order of the legs, None for a leg which failed
+        """
+        orders = list(orders)
+        result = [None] * len(orders)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            future_to_leg = {executor.submit(self.placeOrder, order): leg for leg, order in enumerate(orders)}
+            for future in concurrent.futures.as_completed(future_to_leg):
+                leg = future_to_leg[future]
+                try:
+                    result[leg] = future.result()
+                except Exception as exc:
+                    logger.error(f'Order for {orders[leg].tradingsymbol} failed -> {exc}')
+                else:
+                    if result[leg] is not None:
+                        orders[leg].order_id = result[leg].get('norenordno')
 
         return result
 
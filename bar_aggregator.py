@@ -0,0 +1,186 @@
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# NSE FnO trading session 09:15 - 15:30
+SESSION_OPEN = (9, 15)
+SESSION_MINUTES = 375
+
+Bars = namedtuple('Bars', ['start', 'open', 'high', 'low', 'close', 'volume'])
+
+_SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+
+class _BarColumns:
+    """
+    OHLCV bars of one timeframe, one row per token and one column per bar of the session.
+    """
+
+    def __init__(self, max_tokens: int, timeframe: int):
+        self.timeframe = timeframe
+        bars = -(-SESSION_MINUTES // timeframe)
+        self.open = np.zeros((max_tokens, bars), dtype=np.float64)
+        self.high = np.zeros((max_tokens, bars), dtype=np.float64)
+        self.low = np.zeros((max_tokens, bars), dtype=np.float64)
+        self.close = np.zeros((max_tokens, bars), dtype=np.float64)
+        self.volume = np.zeros((max_tokens, bars), dtype=np.int64)
+        # the bars of a row are first[row]:count[row], from the first traded bar to the bar being built
+        self.first = np.zeros(max_tokens, dtype=np.int64)
+        self.count = np.zeros(max_tokens, dtype=np.int64)
+        self.start = np.zeros(bars, dtype=np.int64)
+
+    def reset(self, session_start: int):
+        self.first[:] = 0
+        self.count[:] = 0
+        self.start[:] = session_start + np.arange(self.start.size) * self.timeframe * 60
+
+    def clear(self, row: int):
+        self.first[row] = 0
+        self.count[row] = 0
+
+    def on_tick(self, row: int, minute: int, price: float, volume: int):
+        bar = minute // self.timeframe
+        count = self.count[row]
+        if bar >= count:
+            if count == 0:
+                # the bars before the first tick of the token are not part of its bars, whatever the row held
+                self.first[row] = bar
+            else:
+                # no trade in the bars in between, carry the last close forward
+                last = self.close[row, count - 1]
+                self.open[row, count:bar] = last
+                self.high[row, count:bar] = last
+                self.low[row, count:bar] = last
+                self.close[row, count:bar] = last
+                self.volume[row, count:bar] = 0
+            self.open[row, bar] = price
+            self.high[row, bar] = price
+            self.low[row, bar] = price
+            self.close[row, bar] = price
+            self.volume[row, bar] = volume
+            self.count[row] = bar + 1
+        else:
+            # a late tick is merged into the bar being built
+            bar = count - 1
+            if price > self.high[row, bar]:
+                self.high[row, bar] = price
+            if price < self.low[row, bar]:
+                self.low[row, bar] = price
+            self.close[row, bar] = price
+            self.volume[row, bar] += volume
+
+    def bars(self, row: int) -> Bars:
+        first, count = self.first[row], self.count[row]
+        return Bars(self.start[first:count], self.open[row, first:count], self.high[row, first:count],
+                    self.low[row, first:count], self.close[row, first:count], self.volume[row, first:count])
+
+
+class BarAggregator:
+    """
+    Builds intraday OHLCV bars from the live ticks. All the bars are kept in preallocated columns, a tick only
+    updates the current bar of the token in place. When more than max_tokens tokens are ticking, the token
+    which has not ticked for the longest time is dropped to make room.
+    """
+
+    def __init__(self, timeframes=(1, 5), max_tokens: int = 2048):
+        """
+        :param timeframes: the bar sizes in minutes
+        :param max_tokens: the number of tokens for which bars are kept
+        """
+        self._frames = {tf: _BarColumns(max_tokens, tf) for tf in timeframes}
+        self._rows = {}
+        self._tokens = np.zeros(max_tokens, dtype=np.int64)
+        self._last_tick = np.zeros(max_tokens, dtype=np.float64)
+        self._last_volume = np.full(max_tokens, -1, dtype=np.int64)
+        self._free = list(range(max_tokens - 1, -1, -1))
+        self._session_start = 0
+        self._next_day = 0
+
+    def _reset(self, ts: float):
+        day = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+        self._session_start = int(day.replace(hour=SESSION_OPEN[0], minute=SESSION_OPEN[1]).timestamp())
+        self._next_day = int((day + timedelta(days=1)).timestamp())
+        self._rows.clear()
+        self._free = list(range(self._tokens.size - 1, -1, -1))
+        self._last_tick[:] = 0
+        self._last_volume[:] = -1
+        for frame in self._frames.values():
+            frame.reset(self._session_start)
+
+    def _add(self, token: int) -> int:
+        if self._free:
+            row = self._free.pop()
+        else:
+            row = int(np.argmin(self._last_tick))
+            del self._rows[int(self._tokens[row])]
+        self._tokens[row] = token
+        self._last_volume[row] = -1
+        for frame in self._frames.values():
+            frame.clear(row)
+        self._rows[token] = row
+        return row
+
+    def on_tick(self, token: int, ltp: float, cumulative_volume=None, feed_time=None) -> None:
+        """
+        :param token: the token of the tick
+        :param ltp: the last traded price
+        :param cumulative_volume: the day volume of the token ('v' in the feed), if present in the tick
+        :param feed_time: the epoch time of the tick ('ft' in the feed), the local time is used if not present
+        """
+        ts = float(feed_time) if feed_time else time.time()
+        if ts >= self._next_day:
+            self._reset(ts)
+        minute = int(ts - self._session_start) // 60
+        if minute < 0 or minute >= SESSION_MINUTES:
+            return
+
+        row = self._rows.get(token)
+        if row is None:
+            row = self._add(token)
+        self._last_tick[row] = ts
+
+        volume = 0
+        if cumulative_volume:
+            cumulative_volume = int(cumulative_volume)
+            if self._last_volume[row] >= 0:
+                volume = max(cumulative_volume - self._last_volume[row], 0)
+            self._last_volume[row] = cumulative_volume
+
+        for frame in self._frames.values():
+            frame.on_tick(row, minute, ltp, volume)
+
+    def bars(self, token: int, timeframe: int = 1) -> Bars:
+        """
+        :return: views (not copies) of the bars of the token from its first tick of the day, the last bar is the one
+                 being built. None if no tick is received for the token today
+        """
+        row = self._rows.get(token)
+        if row is None:
+            return None
+        return self._frames[timeframe].bars(row)
+
+    def change(self, token: int) -> float:
+        """
+        :return: the intraday change in % from the first traded price of the day, None if there is no tick yet
+        """
+        bars = self.bars(token, next(iter(self._frames)))
+        if bars is None or bars.open.size == 0 or bars.open[0] == 0:
+            return None
+        return 100 * (bars.close[-1] / bars.open[0] - 1)
+
+
+def sparkline(values: np.ndarray, width: int = 24) -> str:
+    """
+    :return: the last width values drawn as a unicode block sparkline
+    """
+    values = values[-width:]
+    if values.size == 0:
+        return ''
+    low = values.min()
+    span = values.max() - low
+    if span == 0:
+        return _SPARK_CHARS[0] * values.size
+    levels = ((values - low) * ((len(_SPARK_CHARS) - 1) / span)).astype(np.intp)
+    return ''.join(_SPARK_CHARS[i] for i in levels)
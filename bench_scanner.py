@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Times a full FnO scan against a local stand in for the GetQuotes endpoint which answers after a simulated round trip
+with random quotes, so only the timings are meaningful.
+
+    python bench_scanner.py --symbols 200 --latency 0.03 --concurrency 8 --rate 10 --max-expiries 2 [--rest]
+
+--rate caps the requests per second, 10 by default as in the application, 0 for no cap.
+--max-expiries is the number of nearest expiries scanned per symbol, 2 by default as in the application.
+--rest fetches through the pooled keep-alive RestClient instead of the NorenApi calls.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+
+from fno_scanner import FnoScanner, QuoteFetcher, QuoteCache
+
+
+def _make_master(symbols: int, expiries: int, strikes: int) -> pd.DataFrame:
+    rows = []
+    token = 100000
+    today = pd.Timestamp.today().normalize()
+    for s in range(symbols):
+        symbol = f'STK{s:03d}'
+        base = 100 * (1 + s % 40)
+        for e in range(expiries):
+            expiry = today + pd.Timedelta(days=7 + 30 * e)
+            token += 1
+            rows.append((symbol, expiry, 'FUTSTK', 'XX', 0.0, token))
+            for k in range(strikes):
+                strike = base * (0.7 + 0.6 * k / strikes)
+                for option_type in ('CE', 'PE'):
+                    token += 1
+                    rows.append((symbol, expiry, 'OPTSTK', option_type, strike, token))
+    return pd.DataFrame(rows, columns=['Symbol', 'Expiry', 'Instrument', 'OptionType', 'StrikePrice', 'Token'])
+
+
+def _serve(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # the headers and body are written separately, Nagle would hold the body back on a kept alive connection
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            server.requests += 1
+            self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(latency)
+            close = random.uniform(50, 4000)
+            oi = random.randint(1000, 100000)
+            body = json.dumps({'stat': 'Ok', 'lp': f'{close * random.uniform(0.97, 1.03):.2f}', 'c': f'{close:.2f}',
+                               'oi': str(oi), 'poi': str(int(oi * random.uniform(0.9, 1.1)))}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--expiries', type=int, default=3)
+    parser.add_argument('--strikes', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=10)
+    parser.add_argument('--max-expiries', type=int, default=2)
+    parser.add_argument('--rest', action='store_true')
+    args = parser.parse_args()
+
+    from NorenRestApiPy.NorenApi import NorenApi
+
+    server = _serve(args.latency)
+    host = f'http://127.0.0.1:{server.server_address[1]}/'
+    api = NorenApi(host=host, websocket=host.replace('http', 'ws'))
+    api.set_session('bench', 'bench', 'bench')
+
+    master = _make_master(args.symbols, args.expiries, args.strikes)
+    index = master.groupby(['Symbol', 'Expiry']).indices
+    if args.rest:
+        from rest_client import RestClient
+        api = RestClient(api, max_workers=args.concurrency, host=host)
+        api.set_session('bench', 'bench', 'bench')
+    # as in the application, long enough for the second scan to be served from the cache
+    fetcher = QuoteFetcher(api, max_concurrency=args.concurrency, cache=QuoteCache(ttl=3600),
+                           max_rate=args.rate)
+    scanner = FnoScanner(fetcher, master, index)
+
+    for label in ('cold', 'cached'):
+        start = time.perf_counter()
+        requests = server.requests
+        result = scanner.scan(max_expiries=args.max_expiries)
+        took = time.perf_counter() - start
+        print(f'{label:>6}: {len(result.index)} expiries, {server.requests - requests} requests in {took:.2f}s')
+    print(result.head(10).to_string())
+    fetcher.close()
+    server.shutdown()
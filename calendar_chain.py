@@ -0,0 +1,76 @@
+import numpy as np
+
+CE = 0
+PE = 1
+
+
+class CalendarChain:
+    """
+    Option chain of a stock across several expiries on a common set of strikes. Prices are kept in an
+    (expiry, CE/PE, strike) array. The columns of an expiry are filled from the master only when it is first shown.
+    The calendar spread of every visible expiry is its price less the price of the nearest visible expiry.
+    """
+
+    def __init__(self, stock: str, expiries: list, strikes: np.ndarray, lot_size: int):
+        """
+        :param stock: the symbol of the underlying
+        :param expiries: the expiry labels, nearest first
+        :param strikes: the strikes of all the expiries, sorted
+        :param lot_size: the lot size of the underlying
+        """
+        self.stock = stock
+        self.expiries = list(expiries)
+        self.strikes = np.asarray(strikes, dtype=np.float64)
+        self.lot_size = lot_size
+        shape = (len(self.expiries), 2, self.strikes.size)
+        self.prices = np.full(shape, np.nan)
+        self.spreads = np.full(shape, np.nan)
+        self.tokens = np.zeros(shape, dtype=np.int64)
+        self.symbols = np.full(shape, '', dtype=object)
+        self.loaded = np.zeros(len(self.expiries), dtype=bool)
+        self.visible = np.zeros(len(self.expiries), dtype=bool)
+        # token -> (expiry, CE/PE, strike) positions in the arrays
+        self.token_index = {}
+
+    def load_expiry(self, expiry: int, strikes, option_types, tokens, trading_symbols):
+        """
+        Fill the columns of the expiry from its rows of the master
+        """
+        columns = np.searchsorted(self.strikes, np.asarray(strikes, dtype=np.float64))
+        sides = np.where(np.asarray(option_types) == 'PE', PE, CE)
+        self.tokens[expiry, sides, columns] = tokens
+        self.symbols[expiry, sides, columns] = trading_symbols
+        for token, side, column in zip(np.asarray(tokens).tolist(), sides.tolist(), columns.tolist()):
+            self.token_index[token] = (expiry, side, column)
+        self.loaded[expiry] = True
+
+    def subscription(self, expiry: int) -> list:
+        tokens = self.tokens[expiry]
+        return [f'NFO|{token}' for token in tokens[tokens != 0].tolist()]
+
+    def visible_subscription(self) -> list:
+        return [x for expiry in np.flatnonzero(self.visible) for x in self.subscription(expiry)]
+
+    def set_visible(self, expiry: int, visible: bool):
+        self.visible[expiry] = visible
+        self.spreads[:] = np.nan
+        shown = np.flatnonzero(self.visible)
+        if shown.size > 1:
+            self.spreads[shown[1:]] = self.prices[shown[1:]] - self.prices[shown[0]]
+
+    def update(self, token: int, ltp: float):
+        """
+        :return: (expiry, CE/PE, strike) position of the token, None if it is not in the calendar
+        """
+        position = self.token_index.get(token)
+        if position is None:
+            return None
+        expiry, side, column = position
+        self.prices[expiry, side, column] = ltp
+
+        # only the spreads of this strike can change
+        shown = np.flatnonzero(self.visible)
+        if shown.size > 1:
+            near = self.prices[shown[0], side, column]
+            self.spreads[shown[1:], side, column] = self.prices[shown[1:], side, column] - near
+        return position
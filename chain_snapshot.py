@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+# one record per token, sorted by token so that a whole chain is looked up with a single searchsorted
+SNAPSHOT_DTYPE = np.dtype([('token', '<i8'), ('ltp', '<f8'), ('oi', '<f8'), ('time', '<f8')])
+
+
+class ChainSnapshot:
+    """
+    Last known LTP, OI and time of every token seen, persisted as a single .npy file of SNAPSHOT_DTYPE records.
+    The file for the full NFO universe is a few megabytes and is read in one go. The ticks of the session are kept
+    in a dict on top of the saved records and merged into them when saving.
+    """
+    logger = logging.getLogger("ChainSnapshot")
+
+    def __init__(self, filename: str = 'chain_snapshot.npy', max_age_days: float = 7):
+        """
+        :param filename: the snapshot file
+        :param max_age_days: the tokens not seen for longer than this are dropped when saving, e.g. expired contracts
+        """
+        self.filename = filename
+        self.max_age_days = max_age_days
+        self._saved = np.zeros(0, dtype=SNAPSHOT_DTYPE)
+        # token -> [ltp, oi, time] of the ticks received in this session
+        self._live = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    @classmethod
+    def load(cls, filename: str = 'chain_snapshot.npy', **kwargs) -> 'ChainSnapshot':
+        snapshot = cls(filename, **kwargs)
+        try:
+            saved = np.load(filename)
+            if saved.dtype == SNAPSHOT_DTYPE:
+                snapshot._saved = saved
+            else:
+                cls.logger.warning(f'Ignoring {filename}, it is not a chain snapshot')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as exc:
+            cls.logger.warning(f'Unable to read {filename} -> {exc}')
+        return snapshot
+
+    def __len__(self):
+        return self._saved.size + len(self._live)
+
+    @staticmethod
+    def _find(saved: np.ndarray, tokens: np.ndarray):
+        """
+        :return: positions in the saved records and whether the token was found there
+        """
+        saved_tokens = saved['token']
+        if saved_tokens.size == 0:
+            return np.zeros(tokens.size, dtype=np.intp), np.zeros(tokens.size, dtype=bool)
+        positions = np.searchsorted(saved_tokens, tokens).clip(max=saved_tokens.size - 1)
+        return positions, saved_tokens[positions] == tokens
+
+    def update(self, token: int, ltp=None, oi=None, feed_time=None):
+        """
+        Record a tick, safe to call from the websocket thread. The missing fields keep their last known values.
+        """
+        entry = self._live.get(token)
+        if entry is None:
+            with self._lock:
+                saved = self._saved
+                positions, found = self._find(saved, np.array([token], dtype=np.int64))
+                record = saved[positions[0]] if found[0] else None
+                entry = self._live.setdefault(token, [np.nan, np.nan, np.nan] if record is None else
+                                              [float(record['ltp']), float(record['oi']), float(record['time'])])
+        if ltp not in (None, ''):
+            entry[0] = float(ltp)
+        if oi not in (None, ''):
+            entry[1] = float(oi)
+        entry[2] = float(feed_time) if feed_time not in (None, '') else time.time()
+        self._dirty = True
+
+    def lookup(self, tokens):
+        """
+        :param tokens: the tokens of a chain
+        :return: (ltp, oi, time) arrays in the order of tokens, NaN for the tokens never seen
+        """
+        tokens = np.asarray(tokens, dtype=np.int64)
+        values = np.full((3, tokens.size), np.nan)
+        # a save may swap in the merged records meanwhile, the search and the gather use the same array
+        with self._lock:
+            saved = self._saved
+        positions, found = self._find(saved, tokens)
+        saved = saved[positions[found]]
+        values[0, found] = saved['ltp']
+        values[1, found] = saved['oi']
+        values[2, found] = saved['time']
+        for i, token in enumerate(tokens.tolist()):
+            entry = self._live.get(token)
+            if entry is not None:
+                values[:, i] = entry
+        return values[0], values[1], values[2]
+
+    def save(self):
+        """
+        Merge the session's ticks into the saved records and write them out, the file is replaced atomically
+        """
+        if not self._dirty:
+            return
+        self._dirty = False
+        with self._lock:
+            live = {token: list(entry) for token, entry in self._live.items()}
+
+        fresh = np.zeros(len(live), dtype=SNAPSHOT_DTYPE)
+        fresh['token'] = np.fromiter(live.keys(), dtype=np.int64, count=len(live))
+        if len(live) > 0:
+            values = np.array(list(live.values()), dtype=np.float64)
+            fresh['ltp'], fresh['oi'], fresh['time'] = values[:, 0], values[:, 1], values[:, 2]
+
+        kept = self._saved[~np.isin(self._saved['token'], fresh['token'])]
+        kept = kept[kept['time'] >= time.time() - self.max_age_days * 86400]
+        merged = np.concatenate((kept, fresh))
+        # sorting a structured array by a field is slow, the records are reordered by the token column instead
+        merged = merged[np.argsort(merged['token'], kind='stable')]
+
+        try:
+            with open(self.filename + '.tmp', 'wb') as f:
+                np.save(f, merged)
+            os.replace(self.filename + '.tmp', self.filename)
+        except OSError as exc:
+            self.logger.error(f'Unable to save the chain snapshot -> {exc}')
+            self._dirty = True
+            return
+        with self._lock:
+            self._saved = merged
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+
+
+class ChainState:
+    """
+    Live state of an open option chain: the chain frame (which holds the last prices), its table model and the
+    token index used to route price updates to the right cell.
+    """
+
+    def __init__(self, stock: str, expiry: str, frame, lot_size: int, subscription: list, model=None):
+        self.stock = stock
+        self.expiry = expiry
+        self.frame = frame
+        self.lot_size = lot_size
+        self.subscription = subscription
+        self.model = model
+        # the table view showing this chain, set by the window
+        self.view = None
+        # token -> (row, column, price field) of the chain frame
+        self.token_index = {}
+        for row, token in enumerate(frame['CE_Token'].values):
+            self.token_index[int(token)] = (row, 0, 'CE Price')
+        for row, token in enumerate(frame['PE_Token'].values):
+            self.token_index[int(token)] = (row, 2, 'PE Price')
+
+    @property
+    def key(self):
+        return self.stock, self.expiry
+
+
+class ChainWorkspace:
+    """
+    LRU cache of the open option chains. Chains are evicted, least recently used first, when there are more than
+    max_chains of them or when together they subscribe to more than max_subscriptions instruments.
+    """
+
+    def __init__(self, max_chains: int = 8, max_subscriptions: int = 2000):
+        self.max_chains = max_chains
+        self.max_subscriptions = max_subscriptions
+        self._chains = OrderedDict()
+        # token -> the chains showing it
+        self._token_chains = {}
+
+    def __len__(self):
+        return len(self._chains)
+
+    def __iter__(self):
+        return iter(self._chains.values())
+
+    def __contains__(self, key):
+        return key in self._chains
+
+    def get(self, key) -> ChainState:
+        """
+        :return: the chain marked as most recently used, None if it is not open
+        """
+        state = self._chains.get(key)
+        if state is not None:
+            self._chains.move_to_end(key)
+        return state
+
+    def chains_for(self, token: int) -> list:
+        return self._token_chains.get(token, ())
+
+    def subscriptions(self) -> list:
+        """
+        :return: the instruments subscribed by all the open chains
+        """
+        return list(dict.fromkeys(x for state in self._chains.values() for x in state.subscription))
+
+    def put(self, state: ChainState) -> list:
+        """
+        Add the chain as the most recently used one
+        :return: the chains evicted to stay within the budget
+        """
+        self._chains[state.key] = state
+        self._chains.move_to_end(state.key)
+        for token in state.token_index:
+            self._token_chains.setdefault(token, []).append(state)
+
+        evicted = []
+        while len(self._chains) > 1 and (len(self._chains) > self.max_chains or
+                                         sum(len(s.subscription) for s in self._chains.values()) > self.max_subscriptions):
+            evicted.append(self.remove(next(iter(self._chains))))
+        return evicted
+
+    def remove(self, key) -> ChainState:
+        state = self._chains.pop(key)
+        for token in state.token_index:
+            chains = self._token_chains[token]
+            chains.remove(state)
+            if not chains:
+                del self._token_chains[token]
+        return state
@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from symbol_index import SymbolIndex
+
+# rows of the new master which are not in the current one, and the tokens of the current master which are gone.
+# A contract whose details changed (e.g. a lot size revision) is in both.
+MasterDiff = namedtuple('MasterDiff', ['added', 'removed'])
+
+
+class FnoMaster:
+    """
+    The FnO master with the structures derived from it: the (symbol, expiry) -> rows index, the sorted expiries of
+    every symbol and the symbol search index.
+
+    A newer master is applied as a diff by token. The added contracts are appended to the frame and the removed ones
+    are only dropped from the index, so that the row positions held by the index stay valid. The frame is compacted
+    when more than max_stale of its rows have been removed.
+    """
+
+    def __init__(self, data: pd.DataFrame, max_stale: float = 0.5):
+        self.max_stale = max_stale
+        self._build(self.filter(data))
+
+    @staticmethod
+    def filter(data: pd.DataFrame) -> pd.DataFrame:
+        # we are not interested in any of the NIFTY/BankNifty/FinNifty symbols as of now, so exclude them
+        # also, Finvasia packages some TEST symbols in the master data, exclude them as well.
+        return data[~data.Symbol.str.contains("NSETEST") & ~data.Symbol.str.contains("NIFTY")].reset_index(drop=True)
+
+    def _build(self, data: pd.DataFrame):
+        self.data = data
+        self._live = np.ones(len(data.index), dtype=bool)
+        self.symbols = SymbolIndex(data['Symbol'].unique())
+        # (symbol, expiry) -> row positions in data, so that a chain never has to scan the whole master
+        self.index = data.groupby(['Symbol', 'Expiry']).indices
+        self.expiries = {}
+        for symbol, expiry in sorted(self.index):
+            self.expiries.setdefault(symbol, []).append(expiry)
+
+    def __len__(self):
+        return int(self._live.sum())
+
+    def tokens(self) -> np.ndarray:
+        return self.data['Token'].values[self._live]
+
+    def diff(self, data: pd.DataFrame) -> MasterDiff:
+        """
+        :param data: a newer master, as downloaded
+        :return: the changes from the current master to the newer one
+        """
+        data = self.filter(data)
+        current = self.data[self._live].set_index('Token')
+        new = data.set_index('Token')
+        common = new.index.intersection(current.index)
+
+        # contracts present in both are replaced when any of their details changed
+        old_rows = current.loc[common, new.columns].fillna(0)
+        new_rows = new.loc[common].fillna(0)
+        changed = common[(old_rows != new_rows).any(axis=1).values]
+
+        added = data[~data['Token'].isin(current.index) | data['Token'].isin(changed)]
+        removed = np.union1d(current.index.difference(new.index).values, changed.values)
+        return MasterDiff(added.reset_index(drop=True), removed)
+
+    def apply(self, diff: MasterDiff) -> set:
+        """
+        Apply the changes. The frame is only appended to, and the index, the expiries and the symbol index are
+        replaced rather than mutated, so that the readers holding the previous ones are not affected.
+        :return: the symbols whose contracts changed
+        """
+        tokens = self.data['Token'].values
+        removed_rows = np.flatnonzero(self._live & np.isin(tokens, diff.removed))
+        self._live[removed_rows] = False
+
+        index = dict(self.index)
+        removed_keys = self.data.iloc[removed_rows].groupby(['Symbol', 'Expiry']).indices
+        for key, rows in removed_keys.items():
+            remaining = np.setdiff1d(index[key], removed_rows[rows], assume_unique=True)
+            if remaining.size > 0:
+                index[key] = remaining
+            else:
+                del index[key]
+
+        start = len(self.data.index)
+        if len(diff.added.index) > 0:
+            self.data = pd.concat([self.data, diff.added], ignore_index=True)
+            self._live = np.concatenate((self._live, np.ones(len(diff.added.index), dtype=bool)))
+        added_keys = diff.added.groupby(['Symbol', 'Expiry']).indices
+        for key, rows in added_keys.items():
+            existing = index.get(key)
+            rows = rows + start
+            index[key] = rows if existing is None else np.concatenate((existing, rows))
+        self.index = index
+
+        changed = {symbol for symbol, _ in removed_keys} | {symbol for symbol, _ in added_keys}
+        if self._live.size > 0 and 1 - self._live.mean() > self.max_stale:
+            self._build(self.data[self._live].reset_index(drop=True))
+            return changed
+
+        expiries = dict(self.expiries)
+        for symbol in changed:
+            expiries.pop(symbol, None)
+        for symbol, expiry in sorted(key for key in index if key[0] in changed):
+            expiries.setdefault(symbol, []).append(expiry)
+        self.symbols = self.symbols.updated([symbol for symbol in changed if symbol in expiries],
+                                            [symbol for symbol in changed if symbol not in expiries])
+        self.expiries = expiries
+        return changed
+
+    def expiry_dates(self) -> list:
+        """
+        :return: the expiries of all the symbols, nearest first
+        """
+        return sorted({expiry for dates in self.expiries.values() for expiry in dates})
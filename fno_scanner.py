@@ -0,0 +1,318 @@
+import concurrent.futures
+import logging
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Abramowitz and Stegun 7.1.26 approximation of erf, accurate to 1.5e-7 which is plenty for implied volatility
+_ERF_P = 0.3275911
+_ERF_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+
+
+def _norm_cdf(x: np.ndarray) -> np.ndarray:
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + _ERF_P * z)
+    poly = t * (_ERF_A[0] + t * (_ERF_A[1] + t * (_ERF_A[2] + t * (_ERF_A[3] + t * _ERF_A[4]))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def bs_price(spot, strike, t, rate, vol, is_call):
+    """
+    Black Scholes price of European options, all the arguments are arrays of the same shape
+    """
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    d2 = d1 - vol * sqrt_t
+    discount = strike * np.exp(-rate * t)
+    call = spot * _norm_cdf(d1) - discount * _norm_cdf(d2)
+    put = discount * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def implied_volatility(price, spot, strike, t, rate, is_call, iterations: int = 60):
+    """
+    Implied volatility of all the options at once by bisection
+    :return: annualised volatility, NaN where the price is not above the intrinsic value
+    """
+    price, spot, strike, t = (np.asarray(x, dtype=np.float64) for x in (price, spot, strike, t))
+    low = np.full(price.shape, 1e-4)
+    high = np.full(price.shape, 5.0)
+    # missing quotes are NaN, they are dropped by the validity check at the end
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(iterations):
+            mid = 0.5 * (low + high)
+            too_high = bs_price(spot, strike, t, rate, mid, is_call) > price
+            high = np.where(too_high, mid, high)
+            low = np.where(too_high, low, mid)
+        vol = 0.5 * (low + high)
+
+        intrinsic = np.where(is_call, spot - strike * np.exp(-rate * t), strike * np.exp(-rate * t) - spot)
+        valid = (price > np.maximum(intrinsic, 0)) & (spot > 0) & (t > 0)
+    return np.where(valid, vol, np.nan)
+
+
+class QuoteCache:
+    """
+    Quotes by (exchange, token), each kept for ttl seconds
+    """
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._quotes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._quotes.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, key, quote):
+        with self._lock:
+            self._quotes[key] = (time.monotonic() + self.ttl, quote)
+
+    def purge(self):
+        now = time.monotonic()
+        with self._lock:
+            self._quotes = {key: entry for key, entry in self._quotes.items() if entry[0] >= now}
+
+
+class RateLimiter:
+    """
+    Token bucket allowing rate calls per second on average with bursts of up to burst calls, shared by the threads
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class QuoteFetcher:
+    """
+    Fetches quotes one instrument per request, as GetQuotes takes a single token, with at most max_concurrency
+    requests in flight and at most max_rate requests per second. What it can is served from the cache. The
+    instruments are submitted batch_size at a time so that a large scan does not queue all its requests at once.
+    """
+    logger = logging.getLogger("QuoteFetcher")
+
+    # requests per second, the broker throttles the clients sending more
+    DEFAULT_MAX_RATE = 10.0
+
+    def __init__(self, api, max_concurrency: int = 8, batch_size: int = 256, cache: QuoteCache = None,
+                 max_rate: float = DEFAULT_MAX_RATE):
+        """
+        :param api: anything with get_quotes(exchange, token), the ShoonyaApiPy normally
+        :param max_rate: the cap on the requests per second, None for no cap
+        """
+        self.api = api
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else QuoteCache()
+        self._limiter = RateLimiter(max_rate, burst=max_concurrency) if max_rate else None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency,
+                                                               thread_name_prefix='QuoteFetcher')
+
+    def _get_quote(self, key):
+        if self._limiter is not None:
+            self._limiter.acquire()
+        try:
+            return self.api.get_quotes(exchange=key[0], token=str(key[1]))
+        except Exception as exc:
+            self.logger.info(f'Quote for {key} failed -> {exc}')
+            return None
+
+    def fetch(self, keys, progress=None) -> dict:
+        """
+        :param keys: (exchange, token) of the instruments
+        :param progress: called with (quotes done, quotes in all) as the quotes arrive, e.g. to show the progress
+        :return: (exchange, token) -> quote, None for the instruments whose quote could not be fetched
+        """
+        quotes = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            quote = self.cache.get(key)
+            if quote is None:
+                missing.append(key)
+            else:
+                quotes[key] = quote
+
+        total = len(quotes) + len(missing)
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            for key, quote in zip(batch, self._executor.map(self._get_quote, batch)):
+                quotes[key] = quote
+                if quote is not None:
+                    self.cache.put(key, quote)
+                if progress is not None:
+                    progress(len(quotes), total)
+        return quotes
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _field(quotes: dict, keys, name: str) -> np.ndarray:
+    values = np.full(len(keys), np.nan)
+    for i, key in enumerate(keys):
+        quote = quotes.get(key)
+        if quote is not None and quote.get(name) not in (None, ''):
+            values[i] = float(quote[name])
+    return values
+
+
+class FnoScanner:
+    """
+    Computes ATM IV, PCR, futures OI build-up and ATM straddle premium to spot for every underlying and expiry of the
+    FnO master. Quotes are fetched in two rounds: the spot and futures of every underlying first, then the options
+    around the ATM strike of every expiry.
+    """
+    COLUMNS = ['Symbol', 'Expiry', 'Spot', 'Future', 'ATM Strike', 'ATM IV %', 'PCR', 'Fut OI Chg %', 'Build-up',
+               'Premium/Spot %']
+
+    def __init__(self, fetcher: QuoteFetcher, fno_data: pd.DataFrame, fno_index: dict, nse_data: pd.DataFrame = None,
+                 strikes_around_atm: int = 10, rate: float = 0.07):
+        """
+        :param fno_data: the FnO master
+        :param fno_index: (symbol, expiry) -> row positions in fno_data
+        :param nse_data: the NSE master, used for the spot price. The near month future is used when not available
+        :param strikes_around_atm: the number of strikes on either side of ATM used for the PCR
+        :param rate: the risk free rate used for the implied volatility
+        """
+        self.fetcher = fetcher
+        # (fno_data, fno_index), replaced as a whole so that a scan in progress keeps using a consistent pair
+        self.master = (fno_data, fno_index)
+        self.strikes_around_atm = strikes_around_atm
+        self.rate = rate
+        self.spot_tokens = {}
+        if nse_data is not None:
+            equities = nse_data[nse_data['Instrument'] == 'EQ']
+            self.spot_tokens = dict(zip(equities['Symbol'].values, equities['Token'].values))
+
+    def scan(self, symbols=None, max_expiries: int = None, progress=None) -> pd.DataFrame:
+        """
+        :param symbols: the underlyings to scan, all of the master if None
+        :param max_expiries: the number of nearest expiries scanned per underlying, all if None
+        :param progress: called with (round, quotes done, quotes in the round) while the quotes of the two rounds are
+                         fetched
+        :return: a frame with FnoScanner.COLUMNS, one row per underlying and expiry
+        """
+        fno_data, fno_index = self.master
+        self.fetcher.cache.purge()
+        expiries = {}
+        for symbol, expiry in sorted(fno_index):
+            if symbols is None or symbol in symbols:
+                expiries.setdefault(symbol, []).append(expiry)
+        if max_expiries is not None:
+            expiries = {symbol: dates[:max_expiries] for symbol, dates in expiries.items()}
+
+        tokens = fno_data['Token'].values
+        option_types = fno_data['OptionType'].values
+        strikes = fno_data['StrikePrice'].values
+        instruments = fno_data['Instrument'].values
+
+        # round 1: spot and the future of every expiry
+        pairs = [(symbol, expiry) for symbol, dates in expiries.items() for expiry in dates]
+        future_keys = []
+        for pair in pairs:
+            rows = fno_index[pair]
+            futures = rows[np.isin(instruments[rows], ('FUTSTK', 'FUTIDX'))]
+            future_keys.append(('NFO', int(tokens[futures[0]])) if futures.size > 0 else None)
+        spot_keys = [('NSE', int(self.spot_tokens[symbol])) if symbol in self.spot_tokens else None
+                     for symbol, _ in pairs]
+        quotes = self.fetcher.fetch([key for key in future_keys + spot_keys if key is not None],
+                                    None if progress is None else lambda done, total: progress(1, done, total))
+
+        future_price = _field(quotes, future_keys, 'lp')
+        spot = _field(quotes, spot_keys, 'lp')
+        # for the stocks without a spot quote, the near month future stands in
+        near_future = {}
+        for (symbol, _), price in zip(pairs, future_price):
+            near_future.setdefault(symbol, price)
+        spot = np.where(np.isnan(spot), [near_future[symbol] for symbol, _ in pairs], spot)
+
+        # round 2: the options around ATM of every expiry
+        atm_strike = np.full(len(pairs), np.nan)
+        window_keys = []
+        atm_keys = []
+        for i, pair in enumerate(pairs):
+            rows = fno_index[pair]
+            options = rows[np.isin(option_types[rows], ('CE', 'PE'))]
+            chain_strikes = np.unique(strikes[options])
+            if chain_strikes.size == 0 or np.isnan(spot[i]):
+                window_keys.append(([], []))
+                atm_keys.append((None, None))
+                continue
+            atm = int(np.argmin(np.abs(chain_strikes - spot[i])))
+            atm_strike[i] = chain_strikes[atm]
+            window = chain_strikes[max(atm - self.strikes_around_atm, 0):atm + self.strikes_around_atm + 1]
+            in_window = options[np.isin(strikes[options], window)]
+            calls = in_window[option_types[in_window] == 'CE']
+            puts = in_window[option_types[in_window] == 'PE']
+            window_keys.append(([('NFO', int(t)) for t in tokens[calls]], [('NFO', int(t)) for t in tokens[puts]]))
+            atm_call = calls[strikes[calls] == atm_strike[i]]
+            atm_put = puts[strikes[puts] == atm_strike[i]]
+            atm_keys.append((('NFO', int(tokens[atm_call[0]])) if atm_call.size > 0 else None,
+                             ('NFO', int(tokens[atm_put[0]])) if atm_put.size > 0 else None))
+        quotes.update(self.fetcher.fetch([key for calls, puts in window_keys for key in calls + puts],
+                                         None if progress is None else lambda done, total: progress(2, done, total)))
+
+        # the metrics of all the expiries are computed together
+        call_oi = np.array([np.nansum(_field(quotes, calls, 'oi')) for calls, _ in window_keys])
+        put_oi = np.array([np.nansum(_field(quotes, puts, 'oi')) for _, puts in window_keys])
+        pcr = np.divide(put_oi, call_oi, out=np.full(len(pairs), np.nan), where=call_oi > 0)
+
+        atm_call_price = _field(quotes, [call for call, _ in atm_keys], 'lp')
+        atm_put_price = _field(quotes, [put for _, put in atm_keys], 'lp')
+        now = datetime.now()
+        years = np.array([max((expiry.replace(hour=15, minute=30) - now).total_seconds(), 3600) / (365 * 86400)
+                          for _, expiry in pairs])
+        call_iv = implied_volatility(atm_call_price, spot, atm_strike, years, self.rate, True)
+        put_iv = implied_volatility(atm_put_price, spot, atm_strike, years, self.rate, False)
+        # average of the call and put IV, or whichever of them is available
+        atm_iv = 100 * np.where(np.isnan(call_iv), put_iv, np.where(np.isnan(put_iv), call_iv, (call_iv + put_iv) / 2))
+
+        future_oi = _field(quotes, future_keys, 'oi')
+        previous_oi = _field(quotes, future_keys, 'poi')
+        previous_close = _field(quotes, future_keys, 'c')
+        oi_change = np.divide(future_oi - previous_oi, previous_oi, out=np.full(len(pairs), np.nan),
+                              where=previous_oi > 0) * 100
+        price_up = future_price > previous_close
+        oi_up = future_oi > previous_oi
+        build_up = np.where(price_up, np.where(oi_up, 'Long build-up', 'Short covering'),
+                            np.where(oi_up, 'Short build-up', 'Long unwinding'))
+        build_up = np.where(np.isnan(oi_change) | np.isnan(previous_close), '', build_up)
+
+        return pd.DataFrame({
+            'Symbol': [symbol for symbol, _ in pairs],
+            'Expiry': [expiry.strftime('%d-%b-%Y') for _, expiry in pairs],
+            'Spot': spot,
+            'Future': future_price,
+            'ATM Strike': atm_strike,
+            'ATM IV %': atm_iv,
+            'PCR': pcr,
+            'Fut OI Chg %': oi_change,
+            'Build-up': build_up,
+            'Premium/Spot %': 100 * (atm_call_price + atm_put_price) / spot,
+        }, columns=self.COLUMNS)
@@ -1,12 +1,28 @@
 #!/usr/bin/env python
-from PySide6.QtWidgets import QApplication
+# imported first so that the startup timing starts with the process
+from startup import startup_timer
 
-from shoonya_win import ShoonyaWindow
-if __name__ == '__main__':
+import sys
+
+from slot_profiler import profiler
+
+# --profile [output prefix] enables the slot profiling, it has to be set before the UI is imported
+if '--profile' in sys.argv:
+    position = sys.argv.index('--profile')
+    sys.argv.pop(position)
+    profiler.enable(sys.argv.pop(position) if position < len(sys.argv) and not sys.argv[position].startswith('-')
+                    else None)
 
-    import sys
+with startup_timer.phase('import UI'):
+    from PySide6.QtWidgets import QApplication
+
+    from shoonya_win import ShoonyaWindow
+if __name__ == '__main__':
 
     app = QApplication(sys.argv)
-    shoonya_window = ShoonyaWindow()
-    shoonya_window.show()
+    with startup_timer.phase('create window'):
+        shoonya_window = ShoonyaWindow()
+        shoonya_window.show()
+    profiler.watch_event_loop(app)
+    app.aboutToQuit.connect(profiler.report)
     sys.exit(app.exec())
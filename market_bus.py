@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# a tick as fanned out to the clients, the fields missing from the feed message are NaN
+TICK_DTYPE = np.dtype([('token', '<i8'), ('time', '<f8'), ('ltp', '<f8'), ('volume', '<f8'), ('oi', '<f8')])
+
+# every frame sent by the bus is (kind, payload length) followed by the payload
+_HEADER = struct.Struct('<BI')
+FRAME_TICKS = 0
+FRAME_REPLY = 1
+
+DEFAULT_SOCKET = '/tmp/shoonya_bus.sock'
+
+
+def _float(message: dict, name: str) -> float:
+    value = message.get(name)
+    return float(value) if value not in (None, '') else np.nan
+
+
+def _recv_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if data is None or len(data) < size:
+        raise ConnectionError('Market bus connection closed')
+    return data
+
+
+class SubscriptionBook:
+    """
+    instrument -> the clients subscribed to it. An instrument is subscribed upstream when its first client subscribes
+    and unsubscribed when its last client leaves. The client tuples are replaced rather than mutated, so the feed
+    thread reads them without taking the lock.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def clients(self, instrument: str) -> tuple:
+        return self._clients.get(instrument, ())
+
+    def refcount(self, instrument: str) -> int:
+        return len(self._clients.get(instrument, ()))
+
+    def subscribe(self, client, instruments) -> list:
+        """
+        :return: the instruments which are to be subscribed upstream
+        """
+        upstream = []
+        with self._lock:
+            for instrument in dict.fromkeys(instruments):
+                clients = self._clients.get(instrument, ())
+                if client not in clients:
+                    if len(clients) == 0:
+                        upstream.append(instrument)
+                    self._clients[instrument] = clients + (client,)
+        return upstream
+
+    def unsubscribe(self, client, instruments) -> list:
+        """
+        :return: the instruments which are to be unsubscribed upstream
+        """
+        upstream = []
+        with self._lock:
+            for instrument in dict.fromkeys(instruments):
+                clients = self._clients.get(instrument, ())
+                if client in clients:
+                    clients = tuple(c for c in clients if c is not client)
+                    if len(clients) == 0:
+                        del self._clients[instrument]
+                        upstream.append(instrument)
+                    else:
+                        self._clients[instrument] = clients
+        return upstream
+
+
+class _Session:
+    """
+    A connected client. Ticks are queued by the feed thread and sent in batches by the session's own writer thread,
+    so a slow client never holds up the feed. When more than max_pending ticks are queued the oldest are dropped.
+    """
+
+    def __init__(self, sock: socket.socket, max_pending: int):
+        self.sock = sock
+        self.name = ''
+        self.instruments = set()
+        self.connected_at = time.time()
+        self.ticks_sent = 0
+        self.bytes_sent = 0
+        self.batches_sent = 0
+        self.dropped = 0
+        self._pending = deque(maxlen=max_pending)
+        self._ready = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name='MarketBusSession', daemon=True)
+        self._writer.start()
+
+    def put(self, tick: tuple):
+        with self._ready:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(tick)
+            self._ready.notify()
+
+    def send(self, kind: int, payload: bytes):
+        with self._send_lock:
+            self.sock.sendall(_HEADER.pack(kind, len(payload)) + payload)
+            self.bytes_sent += _HEADER.size + len(payload)
+
+    def reply(self, reply: dict):
+        self.send(FRAME_REPLY, json.dumps(reply).encode())
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._ready:
+                while not self._pending and not self._closed:
+                    self._ready.wait()
+                if self._closed:
+                    return
+                batch = list(self._pending)
+                self._pending.clear()
+            try:
+                self.send(FRAME_TICKS, np.array(batch, dtype=TICK_DTYPE).tobytes())
+            except OSError:
+                return
+            self.ticks_sent += len(batch)
+            self.batches_sent += 1
+
+    def stats(self) -> dict:
+        elapsed = max(time.time() - self.connected_at, 1e-9)
+        return {'name': self.name, 'instruments': len(self.instruments), 'ticks_sent': self.ticks_sent,
+                'ticks_per_sec': self.ticks_sent / elapsed, 'bytes_sent': self.bytes_sent,
+                'batches_sent': self.batches_sent, 'pending': len(self._pending), 'dropped': self.dropped,
+                'connected_for': elapsed}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Reads the requests of a client, one JSON object per line:
+        {"op": "hello", "name": "recorder"}
+        {"op": "subscribe", "instruments": ["NFO|43854", ...]}
+        {"op": "unsubscribe", "instruments": [...]}
+        {"op": "stats"}
+    Every request is answered with a reply frame.
+    """
+
+    def handle(self):
+        bus: MarketBus = self.server.bus
+        session = _Session(self.connection, bus.max_pending)
+        bus._add_session(session)
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    session.reply(bus._handle_request(session, request))
+                except (ValueError, KeyError) as exc:
+                    session.reply({'ok': False, 'error': str(exc)})
+        except OSError:
+            pass
+        finally:
+            bus._remove_session(session)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MarketBus:
+    """
+    Local market data bus. It owns the single broker connection (a ShoonyaAPIWrapper) and fans out the ticks of the
+    instruments the local clients subscribed to over a Unix socket. Upstream subscriptions are reference counted
+    across the clients.
+    """
+    logger = logging.getLogger("MarketBus")
+
+    def __init__(self, wrapper, path: str = DEFAULT_SOCKET, max_pending: int = 1 << 16):
+        """
+        :param wrapper: the ShoonyaAPIWrapper to subscribe through, its on_tick signal feeds the bus
+        :param path: the Unix socket the clients connect to
+        :param max_pending: the number of ticks queued per client before the oldest are dropped
+        """
+        self.wrapper = wrapper
+        self.path = path
+        self.max_pending = max_pending
+        self.subscriptions = SubscriptionBook()
+        self.ticks_received = 0
+        self._sessions = []
+        self._lock = threading.Lock()
+        # calls into the wrapper are serialized, its subscription sets are not thread safe
+        self._upstream_lock = threading.Lock()
+        self._server: _UnixServer = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = _UnixServer(self.path, _Handler)
+        self._server.bus = self
+        threading.Thread(target=self._server.serve_forever, name='MarketBus', daemon=True).start()
+        self.logger.info(f'Market bus listening on {self.path}')
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for session in list(self._sessions):
+            session.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def on_tick(self, message: dict):
+        """
+        Fan out a feed message to the clients subscribed to it, called on the websocket thread
+        """
+        self.ticks_received += 1
+        clients = self.subscriptions.clients(f"{message.get('e')}|{message['tk']}")
+        if len(clients) == 0:
+            return
+        tick = (int(message['tk']), _float(message, 'ft') if 'ft' in message else time.time(),
+                _float(message, 'lp'), _float(message, 'v'), _float(message, 'oi'))
+        for session in clients:
+            session.put(tick)
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = list(self._sessions)
+        return {'ticks_received': self.ticks_received, 'upstream_subscriptions': len(self.subscriptions),
+                'clients': [session.stats() for session in sessions]}
+
+    def _add_session(self, session: _Session):
+        with self._lock:
+            self._sessions.append(session)
+
+    def _remove_session(self, session: _Session):
+        with self._lock:
+            self._sessions.remove(session)
+        session.close()
+        self._unsubscribe(session, list(session.instruments))
+
+    def _unsubscribe(self, session: _Session, instruments: list):
+        session.instruments.difference_update(instruments)
+        upstream = self.subscriptions.unsubscribe(session, instruments)
+        if len(upstream) > 0:
+            with self._upstream_lock:
+                self.wrapper.on_unsubscribe_instrument(upstream)
+
+    def _handle_request(self, session: _Session, request: dict) -> dict:
+        op = request['op']
+        if op == 'hello':
+            session.name = str(request.get('name', ''))
+        elif op == 'subscribe':
+            instruments = list(request['instruments'])
+            session.instruments.update(instruments)
+            upstream = self.subscriptions.subscribe(session, instruments)
+            if len(upstream) > 0:
+                with self._upstream_lock:
+                    self.wrapper.on_subscribe_instruments(upstream)
+        elif op == 'unsubscribe':
+            self._unsubscribe(session, list(request['instruments']))
+        elif op == 'stats':
+            return {'ok': True, 'op': op, 'stats': self.stats()}
+        else:
+            raise ValueError(f'Unknown request {op}')
+        return {'ok': True, 'op': op}
+
+
+class MarketBusClient:
+    """
+    Connection to a running MarketBus. The ticks are passed, a batch at a time as a TICK_DTYPE array, to on_ticks on
+    the client's reader thread.
+    """
+
+    def __init__(self, on_ticks=None, path: str = DEFAULT_SOCKET, name: str = ''):
+        """
+        :param on_ticks: called with every batch of ticks received
+        :param path: the Unix socket of the bus
+        :param name: the name of this client in the bus stats
+        """
+        self.on_ticks = on_ticks
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._stream = self._sock.makefile('rb')
+        self._replies = deque()
+        self._reply_ready = threading.Condition()
+        self._request_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name='MarketBusClient', daemon=True)
+        self._reader.start()
+        if name != '':
+            self._request({'op': 'hello', 'name': name})
+
+    def subscribe(self, instruments: list):
+        self._request({'op': 'subscribe', 'instruments': list(instruments)})
+
+    def unsubscribe(self, instruments: list):
+        self._request({'op': 'unsubscribe', 'instruments': list(instruments)})
+
+    def stats(self) -> dict:
+        return self._request({'op': 'stats'})['stats']
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def _request(self, request: dict, timeout: float = 10) -> dict:
+        with self._request_lock:
+            self._sock.sendall(json.dumps(request).encode() + b'\n')
+            with self._reply_ready:
+                if not self._reply_ready.wait_for(lambda: self._replies, timeout=timeout):
+                    raise TimeoutError(f"No reply from the market bus for {request['op']}")
+                reply = self._replies.popleft()
+        if not reply.get('ok'):
+            raise ValueError(reply.get('error'))
+        return reply
+
+    def _read_loop(self):
+        try:
+            while True:
+                kind, size = _HEADER.unpack(_recv_exact(self._stream, _HEADER.size))
+                payload = _recv_exact(self._stream, size)
+                if kind == FRAME_TICKS:
+                    if self.on_ticks is not None:
+                        self.on_ticks(np.frombuffer(payload, dtype=TICK_DTYPE))
+                else:
+                    with self._reply_ready:
+                        self._replies.append(json.loads(payload))
+                        self._reply_ready.notify()
+        except (ConnectionError, OSError, ValueError):
+            pass
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Shares a single Shoonya feed connection with the local clients')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--stats', action='store_true', help='print the stats of the running bus and exit')
+    parser.add_argument('--stats-interval', type=float, default=60, help='seconds between the stats logged')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stats:
+        client = MarketBusClient(path=args.socket)
+        print(json.dumps(client.stats(), indent=2))
+        client.close()
+        sys.exit(0)
+
+    import yaml
+    from PySide6.QtCore import QCoreApplication, QThread, Qt
+
+    from ShoonyaAPIWrapper import ShoonyaAPIWrapper
+    from api_helper import ShoonyaApiPy
+
+    with open('cred.yml') as f:
+        cred = yaml.load(f, Loader=yaml.FullLoader)
+    cred['totp'] = input('Enter TOTP: ')
+
+    # the wrapper handles the REST responses on its own thread, as in the application
+    app = QCoreApplication(sys.argv)
+    wrapper = ShoonyaAPIWrapper(api=ShoonyaApiPy())
+    wrapper_thread = QThread()
+    wrapper.moveToThread(wrapper_thread)
+    wrapper_thread.start()
+    bus = MarketBus(wrapper, path=args.socket)
+    # the ticks are fanned out straight from the websocket thread, there is no Qt event loop in the bus
+    wrapper.on_tick.connect(bus.on_tick, Qt.ConnectionType.DirectConnection)
+    # the login completes on the wrapper's thread, the result is waited for here
+    logged_in = threading.Event()
+    login_result = []
+
+    def on_login_result(success, result):
+        login_result.append(success)
+        logged_in.set()
+
+    wrapper.on_login_result.connect(on_login_result, Qt.ConnectionType.DirectConnection)
+    wrapper.onLogin(cred)
+    try:
+        if not logged_in.wait(timeout=30):
+            sys.exit('Login timed out')
+        if not login_result[0]:
+            sys.exit('Login failed')
+        bus.start()
+        try:
+            while True:
+                time.sleep(args.stats_interval)
+                bus.logger.info(json.dumps(bus.stats()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            bus.stop()
+    finally:
+        wrapper.close()
+        wrapper_thread.quit()
+        wrapper_thread.wait()
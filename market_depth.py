@@ -0,0 +1,104 @@
+import time
+
+import numpy as np
+
+# Shoonya sends 5 levels of bid/ask in the SNAPQUOTE (depth) feed
+DEPTH_LEVELS = 5
+
+BID = 0
+ASK = 1
+PRICE = 0
+QTY = 1
+
+# (message field, side, level, price or qty) for every depth field in the feed
+_DEPTH_FIELDS = [(f'{prefix}{level + 1}', side, level, col)
+                 for side, (price_key, qty_key) in ((BID, ('bp', 'bq')), (ASK, ('sp', 'sq')))
+                 for prefix, col in ((price_key, PRICE), (qty_key, QTY))
+                 for level in range(DEPTH_LEVELS)]
+
+
+class DepthBook:
+    """
+    Keeps the market depth of a few tokens in preallocated ring buffers, so the memory used stays the same however
+    long the session runs. Every update is stored as a full snapshot of the book, the oldest snapshot is overwritten
+    once the ring is full.
+    """
+
+    def __init__(self, max_tokens: int = 2, history: int = 512):
+        """
+        :param max_tokens: the number of tokens that can be tracked at a time
+        :param history: the number of snapshots kept per token
+        """
+        self._history = history
+        # token slot -> ring position -> side -> level -> (price, qty)
+        self._levels = np.zeros((max_tokens, history, 2, DEPTH_LEVELS, 2), dtype=np.float64)
+        self._times = np.zeros((max_tokens, history), dtype=np.int64)
+        # total number of snapshots written per slot, the ring position is count % history
+        self._count = np.zeros(max_tokens, dtype=np.int64)
+        self._slots = {}
+        self._free = list(range(max_tokens - 1, -1, -1))
+
+    def __contains__(self, token):
+        return token in self._slots
+
+    def add(self, token: int) -> None:
+        if token in self._slots:
+            return
+        if not self._free:
+            raise ValueError(f'No free depth slot for token {token}')
+        self._slots[token] = self._free.pop()
+
+    def remove(self, token: int) -> None:
+        slot = self._slots.pop(token, None)
+        if slot is None:
+            return
+        self._levels[slot] = 0
+        self._times[slot] = 0
+        self._count[slot] = 0
+        self._free.append(slot)
+
+    def update(self, token: int, message: dict) -> np.ndarray:
+        """
+        Apply a depth feed message. Shoonya sends only the fields which changed, the rest are carried over from the
+        previous snapshot.
+        :param token: the token the message belongs to
+        :param message: the depth feed message
+        :return: bool array of shape (2, DEPTH_LEVELS), True where the price or qty of the level changed
+        """
+        slot = self._slots[token]
+        ring = self._levels[slot]
+        count = self._count[slot]
+        pos = count % self._history
+        if count > 0:
+            ring[pos] = ring[(count - 1) % self._history]
+
+        current = ring[pos]
+        for field, side, level, col in _DEPTH_FIELDS:
+            value = message.get(field)
+            if value is not None and value != '':
+                current[side, level, col] = float(value)
+
+        self._times[slot, pos] = int(message.get('ft', time.time()))
+        self._count[slot] = count + 1
+
+        if count == 0:
+            return np.ones((2, DEPTH_LEVELS), dtype=bool)
+        return (current != ring[(count - 1) % self._history]).any(axis=-1)
+
+    def latest(self, token: int) -> np.ndarray:
+        """
+        :return: a view of the latest snapshot of shape (2, DEPTH_LEVELS, 2), all zeros if nothing is received yet
+        """
+        slot = self._slots[token]
+        return self._levels[slot, (self._count[slot] - 1) % self._history]
+
+    def history(self, token: int) -> (np.ndarray, np.ndarray):
+        """
+        :return: copy of the stored snapshots and their feed times, oldest first
+        """
+        slot = self._slots[token]
+        count = self._count[slot]
+        if count <= self._history:
+            return self._levels[slot, :count].copy(), self._times[slot, :count].copy()
+        order = np.roll(np.arange(self._history), -(count % self._history))
+        return self._levels[slot, order], self._times[slot, order]
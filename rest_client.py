@@ -0,0 +1,122 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from NorenRestApiPy.NorenApi import NorenApi
+
+
+class RestClient:
+    """
+    Asynchronous access to the REST calls of NorenApi which are on the hot path (login, positions and quotes). Every
+    call is made on a worker pool over a pooled keep-alive session with a timeout, and returns a Future. Identical
+    calls made while one is in flight share its Future instead of sending another request.
+
+    The session of the api is set on login, so the websocket and the rest of the NorenApi calls keep working.
+    """
+    logger = logging.getLogger("RestClient")
+
+    # seconds per route, a call not answered in time fails with requests.Timeout
+    TIMEOUTS = {'authorize': 15.0, 'positions': 5.0, 'getquotes': 3.0}
+    DEFAULT_TIMEOUT = 10.0
+
+    # the host ShoonyaApiPy connects to and the paths of the routes, appended to the host as NorenApi does
+    HOST = 'https://api.shoonya.com/NorenWClientTP/'
+    ROUTES = {'authorize': '/QuickAuth', 'positions': '/PositionBook', 'getquotes': '/GetQuotes'}
+
+    def __init__(self, api: NorenApi, max_workers: int = 8, host: str = HOST, routes: dict = None):
+        """
+        :param api: the NorenApi whose session is set on login
+        :param max_workers: the number of calls in flight at a time, also the size of the connection pool
+        :param host: the REST host, the one the api was created with
+        :param routes: route -> path, RestClient.ROUTES if not given
+        """
+        self.api = api
+        self.host = host
+        self.routes = routes if routes is not None else self.ROUTES
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='RestClient')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._userid = None
+        self._usertoken = None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _post(self, route: str, values: dict, timeout: float):
+        payload = 'jData=' + json.dumps(values)
+        if self._usertoken is not None:
+            payload += f'&jKey={self._usertoken}'
+        res = self.session.post(f'{self.host}{self.routes[route]}', data=payload, timeout=timeout)
+        return json.loads(res.text)
+
+    def _submit(self, route: str, values: dict, parse, timeout: float = None) -> concurrent.futures.Future:
+        key = (route, json.dumps(values, sort_keys=True))
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(lambda: parse(self._post(route, values, timeout or self.TIMEOUTS.get(
+                route, self.DEFAULT_TIMEOUT))))
+            self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._done(key))
+        return future
+
+    def _done(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def login(self, userid, password, twoFA, vendor_code, api_secret, imei) -> concurrent.futures.Future:
+        """
+        :return: a Future of the login response, None if the login was rejected
+        """
+        app_key = hashlib.sha256(f'{userid}|{api_secret}'.encode('utf-8')).hexdigest()
+        values = {'source': 'API', 'apkversion': '1.0.0', 'uid': userid,
+                  'pwd': hashlib.sha256(password.encode('utf-8')).hexdigest(), 'factor2': twoFA, 'vc': vendor_code,
+                  'appkey': app_key, 'imei': imei}
+
+        def parse(response):
+            if response.get('stat') != 'Ok':
+                return None
+            self.set_session(userid, password, response['susertoken'])
+            return response
+
+        self._usertoken = None
+        return self._submit('authorize', values, parse)
+
+    def set_session(self, userid, password, usertoken):
+        """
+        Use a session logged in elsewhere, it is set on the api as well
+        """
+        self._userid = userid
+        self._usertoken = usertoken
+        self.api.set_session(userid=userid, password=password, usertoken=usertoken)
+
+    def positions(self) -> concurrent.futures.Future:
+        """
+        :return: a Future of the position book, None if it could not be fetched
+        """
+        return self._submit('positions', {'uid': self._userid, 'actid': self._userid},
+                            lambda response: response if isinstance(response, list) else None)
+
+    def quotes(self, exchange: str, token) -> concurrent.futures.Future:
+        """
+        :return: a Future of the quote, None if it could not be fetched
+        """
+        return self._submit('getquotes', {'uid': self._userid, 'exch': exchange, 'token': str(token)},
+                            lambda response: response if response.get('stat') == 'Ok' else None)
+
+    def get_quotes(self, exchange: str, token):
+        """
+        Blocking quote with the NorenApi signature, so that the client can stand in for the api (e.g. in QuoteFetcher)
+        """
+        return self.quotes(exchange, token).result()
@@ -1,28 +1,42 @@
 import concurrent.futures
 from datetime import datetime
 from logging import Logger
-from typing import Any
+from typing import Any, TYPE_CHECKING
 
-import requests
-import pandas as pd
 from zipfile import ZipFile
 from io import BytesIO
 
+import numpy as np
+
 from PySide6 import QtCore
-from PySide6.QtCore import Signal, QThread, Slot
-from PySide6.QtWidgets import QDialog, QLabel, QPushButton, QListWidget, QVBoxLayout, QHBoxLayout, QComboBox, \
-    QTableView, QHeaderView, QAbstractItemView, QInputDialog, QListWidgetItem, QTabWidget
+from PySide6.QtCore import Signal, QThread, Slot, QTimer, QSortFilterProxyModel
+from PySide6.QtWidgets import QWidget, QApplication, QDialog, QLabel, QPushButton, QListView, QVBoxLayout, QHBoxLayout, QComboBox, \
+    QTableView, QHeaderView, QAbstractItemView, QInputDialog, QTabWidget, QCheckBox, QLineEdit, QMessageBox
 
-from ShoonyaAPIWrapper import ShoonyaAPIWrapper
-from api_helper import ShoonyaApiPy, Order, BuyOrderMarket, SellOrderMarket, BuyOrder
 import os
 import logging
-import yaml
 
 #enable dbug to see request and responses
 logging.basicConfig(level=logging.INFO)
 
-from table_model import OptionChainTableModel, QHighlightDelegate, PositionsTableModel
+# pandas, requests and the Shoonya API are heavy to import, they are imported on the worker threads once the
+# window is up (see ShoonyaWindow._start_services) and only referenced locally after that.
+if TYPE_CHECKING:
+    import pandas as pd
+    from ShoonyaAPIWrapper import ShoonyaAPIWrapper
+    from api_helper import Order
+    from fno_master import FnoMaster, MasterDiff
+
+from bar_aggregator import BarAggregator
+from calendar_chain import CalendarChain
+from chain_snapshot import ChainSnapshot
+from chain_workspace import ChainState, ChainWorkspace
+from market_depth import DepthBook
+from slot_profiler import profiler
+from startup import startup_timer
+from symbol_index import SymbolIndex
+from table_model import OptionChainTableModel, QHighlightDelegate, PositionsTableModel, DepthTableModel, \
+    SymbolListModel, CalendarTableModel, ScannerTableModel
 
 
 class TaskManager(QtCore.QObject):
@@ -54,67 +68,160 @@ class ShoonyaWindow(QDialog):
     on_subscribe_instrument = Signal(list)
     on_unsubscribe_instrument = Signal(list)
     get_positions = Signal()
+    place_basket = Signal(object)
+    on_subscribe_depth = Signal(list)
+    on_unsubscribe_depth = Signal(list)
+    # (round, quotes done, quotes in the round) of the running FnO scan, emitted from scanTask
+    scan_progress = Signal(int, int, int)
 
     def __init__(self, parent=None):
         super(ShoonyaWindow, self).__init__(parent)
         self.cred = None
         #load the credentials file first, we won't continue without that
-        try:
-            with open('cred.yml') as f:
-                self.cred = yaml.load(f, Loader=yaml.FullLoader)
-        except:
-            raise FileNotFoundError("Can't find or load credential file. Please ensure you have a valid cred.yml file")
+        with startup_timer.phase('load credentials'):
+            import yaml
+            try:
+                with open('cred.yml') as f:
+                    self.cred = yaml.load(f, Loader=yaml.FullLoader)
+            except:
+                raise FileNotFoundError("Can't find or load credential file. Please ensure you have a valid cred.yml file")
 
         # set root certificate path in case you are behind ZScalar or similar enterprise network
         if self.cred['ca_bundle_path'] != '':
             os.environ['REQUESTS_CA_BUNDLE'] = self.cred['ca_bundle_path']
 
-        # create the downloader task to download and read fno master file
-        fno_downloader = TaskManager(self, max_workers=2)
-        fno_downloader.submit(self._read_fno_master)
-        fno_downloader.finished.connect(self.on_fno_download_complete)
-
-        nse_downloader = TaskManager(self, max_workers=2)
-        nse_downloader.submit(self._read_nse_master)
-        nse_downloader.finished.connect(self.on_nse_download_complete)
-
-        # initialize the Shoonya API wrapper
-        self.shoonyaApiWrapper = ShoonyaAPIWrapper(api=ShoonyaApiPy())
-        # create a new thread
-        t = QThread(self)
-        # move the api wrapper object to thread so that it runs on a separate thread.
-        self.shoonyaApiWrapper.moveToThread(t)
-        # start the thread
-        t.start()
+        # the Shoonya API wrapper is created once its modules are imported, see _start_services
+        self.shoonyaApiWrapper: ShoonyaAPIWrapper = None
+        # intraday bars of the subscribed tokens, fed by the API wrapper. Sized for a full chain workspace with
+        # room for the positions, so that the tokens on screen are never evicted
+        max_subscriptions = self.cred.get('max_chain_subscriptions', 2000)
+        self.bars = BarAggregator(max_tokens=max_subscriptions + 256)
+        # the last known prices, shown by a chain until its live ticks arrive. Saved periodically and at quit
+        with startup_timer.phase('load chain snapshot'):
+            self.chainSnapshot = ChainSnapshot.load()
+        self.snapshotTask = TaskManager(self, max_workers=1)
+        self.snapshotTimer = QTimer(self)
+        self.snapshotTimer.setInterval(int(self.cred.get('snapshot_save_seconds', 60) * 1000))
+        self.snapshotTimer.timeout.connect(lambda: self.snapshotTask.submit(self.chainSnapshot.save))
+        self.snapshotTimer.start()
+        self._pending_startup_tasks = set()
+        QApplication.instance().aboutToQuit.connect(self._on_about_to_quit)
 
         self._isLoggedIn = False
+        # the chain shown in the current tab, the other open chains are kept live in the workspace
+        self.currentChainState: ChainState = None
         self.currentChain = None
         self.lotSize = 0
         self.currentStock = ""
-        self.currentSubscription = None
+        self.chainWorkspace = ChainWorkspace(max_chains=self.cred.get('max_chains', 8),
+                                             max_subscriptions=max_subscriptions)
+        # the multi expiry view of a stock, shown in its own tab
+        self.calendar: CalendarChain = None
+        self.calendarView: QTableView = None
+        self.calendarWidget: QWidget = None
+        # the FnO scanner tab, the scan itself runs on scanTask
+        self.scannerWidget: QWidget = None
+        self.scanner = None
+        self.scanTask = TaskManager(self, max_workers=1)
         self.buyOrder: Order = None
         self.sellOrder: Order = None
-        self.fnoData: pd.DataFrame = None
+        self.fnoMaster: FnoMaster = None
+        # the master is downloaded again when the day changes, and applied as a diff without touching the open chains
+        self.masterDate = None
+        self.masterRefreshTask = TaskManager(self, max_workers=1)
+        self.masterRefreshTimer = QTimer(self)
+        self.masterRefreshTimer.setInterval(10 * 60 * 1000)
+        # positions are refreshed periodically while logged in, the fetch runs off the wrapper thread
+        self.positionsTimer = QTimer(self)
+        self.positionsTimer.setInterval(int(self.cred.get('positions_refresh_seconds', 30) * 1000))
+        self.nseData: pd.DataFrame = None
         self.stockData: pd.DataFrame = None
         self.current_positions: pd.DataFrame = None
-
+        # market depth is tracked only for the selected strike
+        self.depthBook = DepthBook()
+        self.depthToken = None
+        # the token of the option selected in the current chain, its depth is shown when depth is turned on
+        self.selectedToken = None
 
         # creating the UI
         self._setup_ui()
         self._setup_signals()
         self._setup_ui_styling()
 
+        # everything else is loaded once the window is shown
+        QTimer.singleShot(0, self._start_services)
+
+    def _start_services(self):
+        """
+        Load both the masters and import the Shoonya API in parallel, the UI is filled in as each one completes.
+        """
+        startup_timer.mark('window shown')
+        loader = TaskManager(self, max_workers=3)
+        loader.finished.connect(self._on_startup_task_complete)
+        self._pending_startup_tasks = {'NFO', 'NSE', 'API'}
+        loader.submit(self._read_fno_master)
+        loader.submit(self._read_nse_master)
+        loader.submit(self._import_api)
+
+    @Slot(object)
+    def _on_startup_task_complete(self, task):
+        with startup_timer.phase(f'show {task}'):
+            if task == 'NFO':
+                self.on_fno_download_complete()
+            elif task == 'NSE':
+                self.on_nse_download_complete()
+            elif task == 'API':
+                self._setup_api()
+
+        self._pending_startup_tasks.discard(task)
+        if len(self._pending_startup_tasks) == 0:
+            startup_timer.mark('ready')
+            startup_timer.report()
+
+    def _import_api(self):
+        with startup_timer.phase('import API'):
+            import ShoonyaAPIWrapper
+        return 'API'
+
+    def _setup_api(self):
+        from ShoonyaAPIWrapper import ShoonyaAPIWrapper
+        from api_helper import ShoonyaApiPy
+
+        # initialize the Shoonya API wrapper
+        self.shoonyaApiWrapper = ShoonyaAPIWrapper(api=ShoonyaApiPy(), bars=self.bars,
+                                                    snapshot=self.chainSnapshot)
+        # create a new thread
+        t = QThread(self)
+        # move the api wrapper object to thread so that it runs on a separate thread.
+        self.shoonyaApiWrapper.moveToThread(t)
+        # start the thread
+        t.start()
+
+        self._setup_api_signals()
+        self.loginButton.setEnabled(True)
+
     def _setup_ui(self):
         self.nameLabel = QLabel("Not Logged In")
         self.loginButton = QPushButton("Login")
+        # enabled once the API is loaded
+        self.loginButton.setEnabled(False)
 
         self.exitAllPositionButton = QPushButton("Exit All Positions")
         self.exitSelectedPositionButton = QPushButton("Exit Selected Position")
         self.buy = QPushButton("Buy")
         self.sell = QPushButton("Sell")
 
-        self.fno_stock_list = QListWidget()
-        self.nse_stock_list = QListWidget()
+        self.symbolSearch = QLineEdit()
+        self.symbolSearch.setPlaceholderText("Search")
+        self.symbolSearch.setClearButtonEnabled(True)
+
+        # the symbol lists are views over the master data, no item is created per symbol
+        self.fno_stock_list = QListView()
+        self.fno_stock_list.setUniformItemSizes(True)
+        self.fno_stock_list.setModel(SymbolListModel())
+        self.nse_stock_list = QListView()
+        self.nse_stock_list.setUniformItemSizes(True)
+        self.nse_stock_list.setModel(SymbolListModel())
 
         optionsview_container = QVBoxLayout()
         expiry_layout = QHBoxLayout()
@@ -133,13 +240,25 @@ class ShoonyaWindow(QDialog):
         expiry_layout.addWidget(order_type, stretch=0)
         expiry_layout.addWidget(self.orderCombo, stretch=1)
 
-        self.optionsTable = QTableView()
-        self.optionsTable.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        self.optionsTable.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.depthCheck = QCheckBox("Market Depth")
+        expiry_layout.addWidget(self.depthCheck, stretch=0)
+
+        self.calendarButton = QPushButton("Calendar")
+        expiry_layout.addWidget(self.calendarButton, stretch=0)
+
+        # one tab per open chain, see _update_option_chain
+        self.chainTabs = QTabWidget()
+        self.chainTabs.setTabsClosable(True)
 
         options_table_layout = QVBoxLayout()
         options_table_layout.addWidget(QLabel("Option Chain"))
-        options_table_layout.addWidget(self.optionsTable)
+        options_table_layout.addWidget(self.chainTabs)
+
+        self.depthTable = QTableView()
+        self.depthTable.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.depthTable.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.depthTable.setVisible(False)
+        options_table_layout.addWidget(self.depthTable)
 
         self.bannedWarning = QLabel("This SCRIP is in BAN. Order placing is not allowed")
         self.bannedWarning.setVisible(False)
@@ -156,8 +275,14 @@ class ShoonyaWindow(QDialog):
         ordersTabView.addTab(self.stocks_fno_positions, "Stocks FnO")
         ordersTabView.addTab(self.index_fno_positions, "Index")
 
+        self.exitAllPositionButton.setEnabled(False)
+
+        positions_header = QHBoxLayout()
+        positions_header.addWidget(QLabel("Current Positions"), stretch=1)
+        positions_header.addWidget(self.exitAllPositionButton, stretch=0)
+
         order_table_view = QVBoxLayout()
-        order_table_view.addWidget(QLabel("Current Positions"))
+        order_table_view.addLayout(positions_header)
         order_table_view.addWidget(ordersTabView)
 
         button_container = QHBoxLayout()
@@ -183,12 +308,20 @@ class ShoonyaWindow(QDialog):
         tab_layout = QTabWidget()
         tab_layout.addTab(self.fno_stock_list, "FnO")
         tab_layout.addTab(self.nse_stock_list, "Cash")
-        hbox_layout.addWidget(tab_layout, stretch=0)
+        symbols_layout = QVBoxLayout()
+        symbols_layout.addWidget(self.symbolSearch)
+        symbols_layout.addWidget(tab_layout)
+        hbox_layout.addLayout(symbols_layout, stretch=0)
         hbox_layout.addLayout(optionsview_container, stretch=1)
 
         self.infoLayout = QHBoxLayout()
         self.infoLayout.addWidget(self.nameLabel)
         self.infoLayout.addStretch(1)
+        self.scannerButton = QPushButton("Scanner")
+        self.infoLayout.addWidget(self.scannerButton)
+        self.refreshMasterButton = QPushButton("Refresh Master")
+        self.refreshMasterButton.setEnabled(False)
+        self.infoLayout.addWidget(self.refreshMasterButton)
         self.infoLayout.addWidget(self.loginButton)
 
         main_layout = QVBoxLayout()
@@ -232,37 +365,65 @@ class ShoonyaWindow(QDialog):
                                       '}'
                                       )
         self.fno_stock_list.setStyleSheet(
-            'QListWidget::item {'
+            'QListView::item {'
             'font-size: 16px;'
             'padding: 8px;'
             '}'
         )
 
         self.nse_stock_list.setStyleSheet(
-            'QListWidget::item {'
+            'QListView::item {'
             'font-size: 16px;'
             'padding: 8px;'
             '}'
         )
 
-    def _setup_signals(self):
+    def _setup_api_signals(self):
         self.on_perform_login.connect(self.shoonyaApiWrapper.onLogin)
         self.on_perform_logout.connect(self.shoonyaApiWrapper.onLogout)
         self.on_subscribe_instrument.connect(self.shoonyaApiWrapper.on_subscribe_instruments)
+        self.on_unsubscribe_instrument.connect(self.shoonyaApiWrapper.on_unsubscribe_instrument)
         self.get_positions.connect(self.shoonyaApiWrapper.on_get_positions)
+        self.place_basket.connect(self.shoonyaApiWrapper.on_place_basket)
+        self.on_subscribe_depth.connect(self.shoonyaApiWrapper.on_subscribe_depth)
+        self.on_unsubscribe_depth.connect(self.shoonyaApiWrapper.on_unsubscribe_depth)
 
         self.shoonyaApiWrapper.on_login_result.connect(self._on_login)
         self.shoonyaApiWrapper.on_price_updates.connect(self._on_price_update)
         self.shoonyaApiWrapper.on_position_result.connect(self._on_positions_results)
         self.shoonyaApiWrapper.on_positions_price_updates.connect(self._on_position_price_update)
+        self.shoonyaApiWrapper.on_basket_result.connect(self._on_basket_result)
+        self.shoonyaApiWrapper.on_depth_updates.connect(self._on_depth_update)
 
+    def _setup_signals(self):
         self.loginButton.clicked.connect(self.on_login_clicked)
-        self.fno_stock_list.itemClicked.connect(self.on_fno_stock_selected)
-        self.nse_stock_list.itemClicked.connect(self.on_nse_stock_selected)
+        self.fno_stock_list.clicked.connect(self.on_fno_stock_selected)
+        self.nse_stock_list.clicked.connect(self.on_nse_stock_selected)
+        self.symbolSearch.textChanged.connect(self.on_symbol_search)
         self.expiryCombo.currentIndexChanged.connect(self.on_update_expiry_date)
         self.orderCombo.currentIndexChanged.connect(self.on_update_order_type)
-        self.optionsTable.clicked.connect(self._option_selected)
+        self.chainTabs.currentChanged.connect(self.on_chain_tab_changed)
+        self.chainTabs.tabCloseRequested.connect(self.on_chain_tab_closed)
+        self.calendarButton.clicked.connect(self._open_calendar)
+        self.scannerButton.clicked.connect(self._open_scanner)
+        self.scanTask.finished.connect(self._on_scan_complete)
+        self.scan_progress.connect(self._on_scan_progress)
+        self.refreshMasterButton.clicked.connect(self.refresh_fno_master)
+        self.masterRefreshTask.finished.connect(self._on_fno_master_diff)
+        self.masterRefreshTimer.timeout.connect(self._on_refresh_timer)
+        self.positionsTimer.timeout.connect(self.get_positions)
         self.stocks_fno_positions.clicked.connect(self._order_selected)
+        self.exitAllPositionButton.clicked.connect(self._exit_all_positions)
+        self.depthCheck.toggled.connect(self.on_depth_toggled)
+
+    def _on_about_to_quit(self):
+        if self.shoonyaApiWrapper is not None:
+            self.shoonyaApiWrapper.close()
+        if self.scanner is not None:
+            self.scanner.fetcher.close()
+        self.snapshotTimer.stop()
+        self.snapshotTask.executor.shutdown(wait=True)
+        self.chainSnapshot.save()
 
     ### called when login button is clicked
     def on_login_clicked(self):
@@ -278,7 +439,10 @@ class ShoonyaWindow(QDialog):
                 self.loginButton.setText("Logging in...")
         else:
             self._isLoggedIn = False
+            self._select_depth(None)
+            self.positionsTimer.stop()
             self.on_perform_logout.emit()
+            self.exitAllPositionButton.setEnabled(False)
             self.loginButton.setText("Login")
             self.nameLabel.setText("Not Logged In")
 
@@ -292,101 +456,419 @@ class ShoonyaWindow(QDialog):
             # perform subscription to selected instrument
             self._emit_subscription()
 
-            # fetch current open positions
+            # fetch current open positions, and keep them refreshed
             self.get_positions.emit()
+            self.positionsTimer.start()
 
         else:
             self.nameLabel.setText("Not Logged In")
             self.loginButton.setText("Login")
 
-    def _emit_subscription(self):
-        if self.currentSubscription is not None and self._isLoggedIn:
-            self.on_subscribe_instrument.emit(self.currentSubscription)
-            self.currentSubscription = None
+        self.exitAllPositionButton.setEnabled(success)
 
-    def _emit_unsubscribe(self):
-        if self.currentSubscription is not None and self._isLoggedIn:
-            self.on_subscribe_instrument.emit(self.currentSubscription)
-            self.currentSubscription = None
+    def _emit_subscription(self):
+        # the wrapper subscribes only to the instruments which are not already subscribed
+        subscription = self.chainWorkspace.subscriptions()
+        if self.calendar is not None:
+            subscription += self.calendar.visible_subscription()
+        if len(subscription) > 0 and self._isLoggedIn:
+            self.on_subscribe_instrument.emit(subscription)
+
+    def _unsubscribe(self, instruments):
+        """
+        Unsubscribe the instruments which no open chain, the calendar or a position needs any more.
+        """
+        in_use = set(self.chainWorkspace.subscriptions())
+        if self.calendar is not None:
+            in_use.update(self.calendar.visible_subscription())
+        if self.current_positions is not None:
+            in_use.update(f'NFO|{token}' for token in self.current_positions['Token'].values)
+        released = [x for x in dict.fromkeys(instruments) if x not in in_use]
+        if len(released) > 0 and self._isLoggedIn:
+            self.on_unsubscribe_instrument.emit(released)
+
+    def _release_chains(self, states):
+        """
+        Close the tabs of the chains removed from the workspace and unsubscribe the instruments no other open chain
+        or position needs.
+        """
+        for state in states:
+            self.chainTabs.removeTab(self.chainTabs.indexOf(state.view))
+            state.view.deleteLater()
+
+        self._unsubscribe([x for state in states for x in state.subscription])
 
     def _read_fno_master(self):
         # check if there is already a file downloaded today
         from datetime import date
         from pathlib import Path
+        with startup_timer.phase('import pandas (NFO)'):
+            import pandas as pd
         filename = f'NFO_{str(date.today())}.txt'
         if Path(filename).is_file():
-            self.fnoData = pd.read_csv(filename, parse_dates=[5])
+            with startup_timer.phase('read NFO master'):
+                fno_data = pd.read_csv(filename, parse_dates=[5])
         else:
-            r = requests.get("https://api.shoonya.com/NFO_symbols.txt.zip")
-            files = ZipFile(BytesIO(r.content))
-            # read the csv file with in the zip
-            self.fnoData = pd.read_csv(files.open("NFO_symbols.txt"), parse_dates=[5])
-            self.fnoData.to_csv(filename, index=False, header=True)
+            startup_timer.cold = True
+            with startup_timer.phase('download NFO master'):
+                fno_data = self._download_fno_master()
+                fno_data.to_csv(filename, index=False, header=True)
+
+        with startup_timer.phase('index NFO master'):
+            from fno_master import FnoMaster
+            self.fnoMaster = FnoMaster(fno_data)
+            self.masterDate = date.today()
+        return 'NFO'
+
+
+    @staticmethod
+    def _download_fno_master():
+        import pandas as pd
+        import requests
+        r = requests.get("https://api.shoonya.com/NFO_symbols.txt.zip")
+        files = ZipFile(BytesIO(r.content))
+        # read the csv file with in the zip
+        return pd.read_csv(files.open("NFO_symbols.txt"), parse_dates=[5])
+
+    def refresh_fno_master(self):
+        if self.fnoMaster is None:
+            return
+        self.refreshMasterButton.setEnabled(False)
+        self.masterRefreshTask.submit(self._diff_fno_master)
 
-        # we are not interested in any of the NIFTY/BankNifty/FinNifty symbols as of now, so exclude them
-        # also, Finvasia packages some TEST symbols in the master data, exclude them as well.
-        self.fnoData = self.fnoData[~self.fnoData.Symbol.str.contains("NSETEST")][~self.fnoData.Symbol.str.contains("NIFTY")]
+    def _on_refresh_timer(self):
+        from datetime import date
+        if self.masterDate != date.today():
+            self.refresh_fno_master()
+
+    def _diff_fno_master(self):
+        """
+        Download the master and diff it against the one in use, runs on masterRefreshTask
+        :return: the MasterDiff, None if the master could not be downloaded
+        """
+        from datetime import date
+        try:
+            fno_data = self._download_fno_master()
+        except Exception as exc:
+            self.logger.error(f'Unable to download the FnO master -> {exc}')
+            return None
+        fno_data.to_csv(f'NFO_{str(date.today())}.txt', index=False, header=True)
+        return self.fnoMaster.diff(fno_data)
+
+    @Slot(object)
+    def _on_fno_master_diff(self, diff: 'MasterDiff'):
+        from datetime import date
+        self.refreshMasterButton.setEnabled(True)
+        if diff is None:
+            return
 
+        # the open chains, the calendar and the subscriptions are left as they are, only the master, the symbol
+        # list and the expiries change
+        changed = self.fnoMaster.apply(diff)
+        self.masterDate = date.today()
+        self.fno_stock_list.model().set_index(self.fnoMaster.symbols)
+        self._update_expiry_dates()
+        if self.scanner is not None:
+            self.scanner.master = (self.fnoMaster.data, self.fnoMaster.index)
+        self.logger.info(f'FnO master refreshed: {len(diff.added.index)} contracts added, {len(diff.removed)} removed'
+                         f' across {len(changed)} symbols')
+
+    def _update_expiry_dates(self):
+        current = self.expiryCombo.currentText()
+        self.expiryCombo.blockSignals(True)
+        self.expiryCombo.clear()
+        # add the expiry dates into the combo widget
+        self.expiryCombo.addItems([expiry.strftime('%d-%b-%Y') for expiry in self.fnoMaster.expiry_dates()])
+        if current != "":
+            self.expiryCombo.setCurrentText(current)
+        self.expiryCombo.blockSignals(False)
 
     def _read_nse_master(self):
         from datetime import date
         from pathlib import Path
+        with startup_timer.phase('import pandas (NSE)'):
+            import pandas as pd
         filename = f'NSE_{str(date.today())}.txt'
         if Path(filename).is_file():
-            self.nseData = pd.read_csv(filename)
+            with startup_timer.phase('read NSE master'):
+                self.nseData = pd.read_csv(filename)
         else:
-            r = requests.get("https://api.shoonya.com/NSE_symbols.txt.zip")
-            files = ZipFile(BytesIO(r.content))
-            self.nseData = pd.read_csv(files.open("NSE_symbols.txt"))
-            self.nseData.to_csv(filename, index=False, header=True)
-
-        # Finvasia packages some TEST symbols in the master data, exclude them as well.
-        self.nseData = self.nseData[~self.nseData.Symbol.str.contains("NSETEST")]
-        # Get only EQ or Index
-        self.nseData = self.nseData[self.nseData['Instrument'].isin(['EQ', 'INDEX'])]
+            startup_timer.cold = True
+            with startup_timer.phase('download NSE master'):
+                import requests
+                r = requests.get("https://api.shoonya.com/NSE_symbols.txt.zip")
+            with startup_timer.phase('read NSE master'):
+                files = ZipFile(BytesIO(r.content))
+                self.nseData = pd.read_csv(files.open("NSE_symbols.txt"))
+                self.nseData.to_csv(filename, index=False, header=True)
+
+        with startup_timer.phase('index NSE master'):
+            # Finvasia packages some TEST symbols in the master data, exclude them as well.
+            self.nseData = self.nseData[~self.nseData.Symbol.str.contains("NSETEST")]
+            # Get only EQ or Index
+            self.nseData = self.nseData[self.nseData['Instrument'].isin(['EQ', 'INDEX'])]
+            self.nseSymbols = SymbolIndex(self.nseData['Symbol'])
+        return 'NSE'
 
 
     def on_fno_download_complete(self):
-        if self.fnoData is None:
+        if self.fnoMaster is None:
             raise ValueError("Unable to read FnO master data. Can't continue")
 
-        # read the list of stocks
-        fno_stock_list = self.fnoData['Symbol'].sort_values(ascending=True).unique()
-
-        # read the expiry dates
-        fno_expiries = self.fnoData['Expiry'].sort_values(ascending=True).unique().strftime('%d-%b-%Y')
-
-        # add the list of stocks into the stock list widget
-        [self.fno_stock_list.addItem(item) for item in [QListWidgetItem(name) for name in fno_stock_list]]
-        # add the expiry dates into the combo widget
-        [self.expiryCombo.addItem(item) for item in fno_expiries]
+        # show the list of stocks in the stock list view
+        self.fno_stock_list.model().set_index(self.fnoMaster.symbols)
+        self._update_expiry_dates()
+        self.refreshMasterButton.setEnabled(True)
+        self.masterRefreshTimer.start()
 
     def on_nse_download_complete(self):
         if self.nseData is None:
             raise ValueError("Unable to read NSE master data. Can't continue")
 
-        [self.nse_stock_list.addItem(item) for item in [QListWidgetItem(name) for name in self.nseData['Symbol'].sort_values(ascending=True)]]
+        self.nse_stock_list.model().set_index(self.nseSymbols)
+
 
+    def on_fno_stock_selected(self, index):
+        self._update_option_chain(index.data())
 
-    def on_fno_stock_selected(self, item):
-        self._update_option_chain(item.text())
+    def on_nse_stock_selected(self, index):
+        self._update_stock_info(index.data())
 
-    def on_nse_stock_selected(self, item):
-        self._update_stock_info(item.text())
+    def on_symbol_search(self, text):
+        self.fno_stock_list.model().set_filter(text)
+        self.nse_stock_list.model().set_filter(text)
 
     def _update_stock_info(self, item):
         logging.info(f'Update stock info for {item}')
 
     def _update_option_chain(self, current_stock):
+        # read the current selected expiry
+        expiry_date = self.expiryCombo.currentText()
+
+        # a chain which is still open is shown as is, with its last known prices
+        state = self.chainWorkspace.get((current_stock, expiry_date))
+        if state is None:
+            state = self._build_option_chain(current_stock, expiry_date)
+
+            state.view = QTableView()
+            state.view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+            state.view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+            state.view.setModel(state.model)
+            state.view.setItemDelegate(QHighlightDelegate(state.model))
+            state.view.clicked.connect(self._option_selected)
+            self.chainTabs.addTab(state.view, f'{current_stock} {expiry_date}')
+
+            # keep the workspace within its budget, the least recently used chains are closed
+            self._release_chains(self.chainWorkspace.put(state))
+            self._emit_subscription()
+
+        self.chainTabs.setCurrentWidget(state.view)
+        self._set_current_chain(state)
+
+    def _set_current_chain(self, state: ChainState):
+        if state is self.currentChainState:
+            return
 
         self.sellButton.setEnabled(False)
         self.buyButton.setEnabled(False)
+        self.selectedToken = None
+        self._select_depth(None)
+
+        self.currentChainState = state
+        if state is None:
+            self.currentChain = None
+            self.currentStock = ""
+            self.lotSize = 0
+            return
+
+        # save the current option chain data frame
+        self.currentChain = state.frame
+        self.currentStock = state.stock
+        self.lotSize = state.lot_size
+        self.chainWorkspace.get(state.key)
+
+        # show the expiry of the chain without building the chain again
+        self.expiryCombo.blockSignals(True)
+        self.expiryCombo.setCurrentText(state.expiry)
+        self.expiryCombo.blockSignals(False)
+
+    def on_chain_tab_changed(self, index):
+        view = self.chainTabs.widget(index)
+        self._set_current_chain(next((state for state in self.chainWorkspace if state.view is view), None))
+
+    def on_chain_tab_closed(self, index):
+        view = self.chainTabs.widget(index)
+        if view is self.calendarWidget:
+            self._close_calendar()
+            return
+        if view is self.scannerWidget:
+            self.chainTabs.removeTab(index)
+            self.scannerWidget.deleteLater()
+            self.scannerWidget = None
+            return
+        state = next((state for state in self.chainWorkspace if state.view is view), None)
+        if state is not None:
+            self._release_chains([self.chainWorkspace.remove(state.key)])
+
+    def _master_rows(self, symbol, expiry):
+        """
+        :param expiry: the expiry as a Timestamp
+        :return: the rows of the master for the symbol and expiry
+        """
+        return self.fnoMaster.data.iloc[self.fnoMaster.index.get((symbol, expiry), [])]
+
+    def _open_calendar(self):
+        if self.currentStock == "" or self.fnoMaster is None:
+            return
+        self._close_calendar()
+
+        stock = self.currentStock
+        expiries = self.fnoMaster.expiries.get(stock, [])
+        # the strikes of all the expiries, only this column is read until an expiry is shown
+        strikes = []
+        for expiry in expiries:
+            rows = self.fnoMaster.index[(stock, expiry)]
+            is_option = np.isin(self.fnoMaster.data['OptionType'].values[rows], ('CE', 'PE'))
+            strikes.append(self.fnoMaster.data['StrikePrice'].values[rows][is_option])
+        strikes = np.unique(np.concatenate(strikes)) if strikes else np.zeros(0)
+        self.calendar = CalendarChain(stock, [expiry.strftime('%d-%b-%Y') for expiry in expiries], strikes,
+                                      self.lotSize)
+
+        self.calendarView = QTableView()
+        self.calendarView.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.calendarView.setModel(CalendarTableModel(self.calendar))
+
+        expiry_checks = QHBoxLayout()
+        expiry_checks.addWidget(QLabel("Expiries: "))
+        for position, label in enumerate(self.calendar.expiries):
+            check = QCheckBox(label)
+            check.toggled.connect(lambda checked, e=position: self._on_calendar_expiry_toggled(e, checked))
+            expiry_checks.addWidget(check)
+        expiry_checks.addStretch(1)
+
+        layout = QVBoxLayout()
+        layout.addLayout(expiry_checks)
+        layout.addWidget(self.calendarView)
+        self.calendarWidget = QWidget()
+        self.calendarWidget.setLayout(layout)
+        self.chainTabs.addTab(self.calendarWidget, f'{stock} Calendar')
+        self.chainTabs.setCurrentWidget(self.calendarWidget)
+
+        # near and next month are shown to begin with
+        checks = self.calendarWidget.findChildren(QCheckBox)
+        for check in checks[:2]:
+            check.setChecked(True)
+        self._update_calendar_columns()
+
+    def _close_calendar(self):
+        if self.calendar is None:
+            return
+        subscription = self.calendar.visible_subscription()
+        self.chainTabs.removeTab(self.chainTabs.indexOf(self.calendarWidget))
+        self.calendarWidget.deleteLater()
+        self.calendar = None
+        self.calendarView = None
+        self.calendarWidget = None
+        self._unsubscribe(subscription)
+
+    def _open_scanner(self):
+        if self.scannerWidget is not None:
+            self.chainTabs.setCurrentWidget(self.scannerWidget)
+            return
+
+        self.scanButton = QPushButton("Scan")
+        self.scanStatus = QLabel("")
+        self.scannerView = QTableView()
+        self.scannerView.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.scannerView.setSortingEnabled(True)
+        self.scanButton.clicked.connect(self._start_scan)
+
+        scan_layout = QHBoxLayout()
+        scan_layout.addWidget(self.scanButton, stretch=0)
+        scan_layout.addWidget(self.scanStatus, stretch=1)
+        layout = QVBoxLayout()
+        layout.addLayout(scan_layout)
+        layout.addWidget(self.scannerView)
+        self.scannerWidget = QWidget()
+        self.scannerWidget.setLayout(layout)
+        self.chainTabs.addTab(self.scannerWidget, "FnO Scanner")
+        self.chainTabs.setCurrentWidget(self.scannerWidget)
+
+    def _start_scan(self):
+        if not self._isLoggedIn or self.fnoMaster is None:
+            self.scanStatus.setText("Login to scan")
+            return
+
+        if self.scanner is None:
+            from fno_scanner import FnoScanner, QuoteFetcher, QuoteCache
+            # every quote is a request and the requests are rate limited, so a scan of the whole market takes many
+            # minutes. The quotes are kept long enough for a rescan to reuse them
+            cache = QuoteCache(ttl=self.cred.get('scan_cache_seconds', 3600))
+            fetcher = QuoteFetcher(self.shoonyaApiWrapper.rest, cache=cache,
+                                   max_rate=self.cred.get('scan_max_rate', QuoteFetcher.DEFAULT_MAX_RATE))
+            self.scanner = FnoScanner(fetcher, self.fnoMaster.data, self.fnoMaster.index, self.nseData)
+        self.scanButton.setEnabled(False)
+        self.scanStatus.setText("Scanning...")
+        self.scanTask.submit(self._run_scan)
+
+    def _run_scan(self):
+        from time import perf_counter
+        start = perf_counter()
+        try:
+            result = self.scanner.scan(max_expiries=self.cred.get('scan_max_expiries', 2),
+                                       progress=self.scan_progress.emit)
+        except Exception as exc:
+            self.logger.error(f'FnO scan failed -> {exc}')
+            result = None
+        return result, perf_counter() - start
+
+    @Slot(int, int, int)
+    def _on_scan_progress(self, scan_round, done, total):
+        if self.scannerWidget is not None:
+            self.scanStatus.setText(f'Scanning, round {scan_round} of 2: {done} of {total} quotes')
+
+    @Slot(object)
+    def _on_scan_complete(self, data):
+        result, took = data
+        if self.scannerWidget is None:
+            return
+        self.scanButton.setEnabled(True)
+        if result is None:
+            self.scanStatus.setText("Scan failed")
+            return
+        self.scanStatus.setText(f'{len(result.index)} expiries scanned in {took:.1f}s')
+        proxy = QSortFilterProxyModel(self.scannerView)
+        proxy.setSourceModel(ScannerTableModel(result))
+        proxy.setSortRole(ScannerTableModel.SortRole)
+        self.scannerView.setModel(proxy)
+
+    def _on_calendar_expiry_toggled(self, expiry, checked):
+        if checked and not self.calendar.loaded[expiry]:
+            import pandas as pd
+            rows = self._master_rows(self.calendar.stock, pd.to_datetime(self.calendar.expiries[expiry]))
+            rows = rows[rows['OptionType'].isin(['CE', 'PE'])]
+            self.calendar.load_expiry(expiry, rows['StrikePrice'].values, rows['OptionType'].values,
+                                      rows['Token'].values, rows['TradingSymbol'].values)
+
+        self.calendar.set_visible(expiry, checked)
+        self._update_calendar_columns()
+        # only the expiries which are shown are subscribed
+        if checked:
+            self._emit_subscription()
+        else:
+            self._unsubscribe(self.calendar.subscription(expiry))
+
+    def _update_calendar_columns(self):
+        model: CalendarTableModel = self.calendarView.model()
+        for column in range(model.columnCount()):
+            self.calendarView.setColumnHidden(column, model.is_column_hidden(column))
+        model.refresh()
 
-        # if there are existing subscription and we are logged in, let's unscribe from previous updates.
-        self._emit_unsubscribe()
+    def _build_option_chain(self, current_stock, expiry_date) -> ChainState:
+        import pandas as pd
 
-        # get the option chain for this stock symbol
-        stock_options_list = self.fnoData[self.fnoData['Symbol'] == current_stock].sort_values(by=['StrikePrice'], ascending=True)
+        # get the option chain for this stock symbol and the expiry date
+        stock_options_list = self._master_rows(current_stock, pd.to_datetime(expiry_date)).sort_values(by=['StrikePrice'], ascending=True)
 
         # prepare the data frame for the options table view. We are displaying only first 3 columns. The other columns
         # are kept so that we can easily access required cells when there is an update as well as we want to place an order.
@@ -394,12 +876,6 @@ class ShoonyaWindow(QDialog):
         # selected option
         df = pd.DataFrame(columns=["CE Price", "Strike", "PE Price", "CE_Token", "CE_TradingSymbol", "PE_Token", "PE_TradingSymbol"], data=[])
 
-        # read the current selected expiry
-        expiry_date = self.expiryCombo.currentText()
-
-        # filter the option chain based on the selected expiry date.
-        stock_options_list = stock_options_list[stock_options_list['Expiry'] == pd.to_datetime(expiry_date)]
-
         #separate the option chain for PE and CE
         current_pe_chain = stock_options_list[stock_options_list['OptionType'] == "PE"]
         current_ce_chain = stock_options_list[stock_options_list['OptionType'] == "CE"]
@@ -412,31 +888,31 @@ class ShoonyaWindow(QDialog):
 
         # fill the data to be displayed in the option chain table.
         df["Strike"] = current_pe_chain["StrikePrice"].values
-        # since we don't have the price information yet, keep it 0
-        df["CE Price"] = 0.0
-        df["PE Price"] = 0.0
         df["PE_Token"] = current_pe_chain['Token'].values
         df["CE_Token"] = current_ce_chain['Token'].values
+        # until the live ticks arrive, show the last known prices from the snapshot, 0 for the ones never seen
+        stale = {}
+        for price_field, token_field, column in (("CE Price", "CE_Token", 0), ("PE Price", "PE_Token", 2)):
+            ltp, oi, at = self.chainSnapshot.lookup(df[token_field].values)
+            df[price_field] = np.nan_to_num(ltp)
+            stale.update({(row, column): (at[row], oi[row]) for row in np.flatnonzero(~np.isnan(ltp)).tolist()})
         df["CE_TradingSymbol"] = current_ce_chain['TradingSymbol'].values
         df["PE_TradingSymbol"] = current_pe_chain['TradingSymbol'].values
 
-        # save the current option chain data frame
-        self.currentChain = df
-        self.currentStock = current_stock
-        self.lotSize = current_ce_chain['LotSize'].values[0]
-
-        # create table model from the option chain and set it to the options table view
-        self.optionsTable.setModel(OptionChainTableModel(data=self.currentChain))
-        self.optionsTable.setItemDelegate(QHighlightDelegate(self.optionsTable.model()))
-
         # prepare the token list for subscribing to price updates.
         ce_subscription = [f'NFO|{name}' for name in current_ce_chain['Token']]
         pe_subscription = [f'NFO|{name}' for name in current_pe_chain['Token']]
 
-        # save the list
-        self.currentSubscription = ce_subscription + pe_subscription
+        # the near month future stands in for the underlying so that its bars are available along with the chain
+        near_month = self._master_rows(current_stock, self.fnoMaster.expiries[current_stock][0])
+        futures = near_month[near_month['Instrument'].isin(['FUTSTK', 'FUTIDX'])]
+        future_subscription = [f'NFO|{name}' for name in futures['Token'].values[:1]]
 
-        self._emit_subscription()
+        # create table model from the option chain, it is set to the chain's table view by the caller
+        model = OptionChainTableModel(data=df, bars=self.bars)
+        model.set_stale(stale)
+        return ChainState(current_stock, expiry_date, df, current_ce_chain['LotSize'].values[0],
+                          ce_subscription + pe_subscription + future_subscription, model=model)
 
     def on_update_expiry_date(self, new_date):
         if self.currentStock != "":
@@ -477,12 +953,47 @@ class ShoonyaWindow(QDialog):
                   f'with Token Number: {token_number} and TradingSymbol = {trading_symbol}'
                   f' lotSize = {self.lotSize}')
 
+            from api_helper import BuyOrderMarket, SellOrderMarket
             self.buyOrder = BuyOrderMarket(tradingSymbol=trading_symbol, qty=self.lotSize)
             self.sellOrder = SellOrderMarket(tradingSymbol=trading_symbol, qty=self.lotSize)
+            self.selectedToken = int(token_number)
+            self._select_depth(self.selectedToken)
 
         else:
             self.logger.info(msg='User selected strike price, nothing to be done')
 
+    def on_depth_toggled(self, checked):
+        self._select_depth(self.selectedToken if checked else None)
+
+    def _select_depth(self, token):
+        """
+        Move the depth subscription to the given token, the depth of the previously selected strike is unsubscribed.
+        :param token: the token of the selected option, None to stop depth updates
+        """
+        if not self.depthCheck.isChecked() or not self._isLoggedIn:
+            token = None
+        if token == self.depthToken:
+            return
+
+        if self.depthToken is not None:
+            self.on_unsubscribe_depth.emit([f'NFO|{self.depthToken}'])
+            self.depthBook.remove(self.depthToken)
+
+        self.depthToken = token
+        if token is not None:
+            self.depthBook.add(token)
+            self.depthTable.setModel(DepthTableModel(self.depthBook, token))
+            self.on_subscribe_depth.emit([f'NFO|{token}'])
+        self.depthTable.setVisible(token is not None)
+
+    @Slot(int, dict)
+    def _on_depth_update(self, token, message):
+        # updates may still arrive for a strike which was just unselected
+        if token != self.depthToken:
+            return
+        changed = self.depthBook.update(token, message)
+        self.depthTable.model().update_levels(changed)
+
     @Slot(int, str, bool)
     def _on_price_update(self, token, ltp, is_banned):
         self.logger.debug(msg=f'Price update received for {token} with ltp = {ltp}. '
@@ -490,32 +1001,18 @@ class ShoonyaWindow(QDialog):
         if ltp == "":
             return
 
-        if self.currentChain is None or self.currentChain.empty:
-            return
-
-        self.bannedWarning.setVisible(is_banned)
-        # check if the update received is for PE or CE
-        is_ce_token = self.currentChain.index[self.currentChain['CE_Token'] == token].values
-        is_pe_token = self.currentChain.index[self.currentChain['PE_Token'] == token].values
-
-        price_col = 0
-        index_val = 0
-        price_field = 'CE Price'
-        # if it is PE or CE symbol, set the Column where Price needs to be updated and the Column name accordingly.
-        if is_pe_token.size > 0:
-            index_val = is_pe_token[0]
-            price_col = 2
-            price_field = 'PE Price'
-        elif is_ce_token.size > 0:
-            index_val = is_ce_token[0]
-            price_col = 0
-        else:
-            # ignore this update
-            return
+        if self.calendar is not None:
+            position = self.calendar.update(token, ltp)
+            if position is not None:
+                self.calendarView.model().update_price(*position)
 
-        pandas_model : OptionChainTableModel = self.optionsTable.model()
-        # ask the model to update the price for the said CELL.
-        pandas_model.update_price(price_field, price_col, index_val, ltp)
+        # every open chain showing this token is updated, so that it is current when its tab is shown again
+        for state in self.chainWorkspace.chains_for(token):
+            if state is self.currentChainState:
+                self.bannedWarning.setVisible(is_banned)
+            index_val, price_col, price_field = state.token_index[token]
+            # ask the model to update the price for the said CELL.
+            state.model.update_price(price_field, price_col, index_val, ltp)
 
     @Slot(int, float)
     def _on_position_price_update(self, token, ltp):
@@ -538,16 +1035,16 @@ class ShoonyaWindow(QDialog):
             targetModel.update_price('LTP', col, row, ltp)
 
 
-    @Slot(bool, pd.DataFrame)
+    @Slot(bool, object)
     def _on_positions_results(self, success, df):
         if not success:
             return
         self.current_positions = df
         if 'OPTSTK' in df['Type'].values:
             # these are stock options
-            self.stocks_fno_positions.setModel(PositionsTableModel(df[df['Type'] == 'OPTSTK']))
+            self.stocks_fno_positions.setModel(PositionsTableModel(df[df['Type'] == 'OPTSTK'], bars=self.bars))
         elif 'OPTIDX' in df['Type'].values:
-            self.index_fno_positions.setModel(PositionsTableModel(df[df['Type'] == 'OPTIDX']))
+            self.index_fno_positions.setModel(PositionsTableModel(df[df['Type'] == 'OPTIDX'], bars=self.bars))
 
     def _order_selected(self, item):
         pass
@@ -557,4 +1054,34 @@ class ShoonyaWindow(QDialog):
         #self.shoonyaAPI.placeOrder(self.buyOrder)
 
     def _sell_option(self):
-        self.logger.debug(msg="Sell option clicked")
\ No newline at end of file
+        self.logger.debug(msg="Sell option clicked")
+
+    def _exit_all_positions(self):
+        if not self._isLoggedIn or self.current_positions is None:
+            return
+
+        from api_helper import OrderBasket
+        basket = OrderBasket.exit_positions(self.current_positions, remarks="Py_Exit_All")
+        if len(basket) == 0:
+            return
+
+        # a market order for every open position, nothing is placed unless it is confirmed
+        answer = QMessageBox.question(self, "Exit All Positions",
+                                      f'Square off {len(basket)} positions with a total quantity of '
+                                      f'{int(basket.quantity.sum())} at market price?',
+                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                      QMessageBox.StandardButton.No)
+        if answer == QMessageBox.StandardButton.Yes:
+            self.logger.info(msg=f'Exit all positions with {len(basket)} legs')
+            self.exitAllPositionButton.setEnabled(False)
+            self.place_basket.emit(basket)
+
+    @Slot(list)
+    def _on_basket_result(self, result):
+        self.exitAllPositionButton.setEnabled(self._isLoggedIn)
+        # refresh the positions so that the squared off legs are reflected
+        self.get_positions.emit()
+
+
+# wraps the slots and callbacks with timing when profiling is enabled, nothing is done otherwise
+profiler.instrument(ShoonyaWindow)
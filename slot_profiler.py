@@ -0,0 +1,146 @@
+import functools
+import inspect
+import logging
+import marshal
+import os
+import threading
+import time
+
+# set to an output path prefix (or 1 for the default one) to profile the slots, main.py also takes --profile
+ENV_VAR = 'SHOONYA_PROFILE'
+DEFAULT_OUTPUT = 'shoonya_profile'
+
+
+class SlotProfiler:
+    """
+    Opt-in profiling of the slots and callbacks. When enabled, the handlers of the instrumented classes are replaced
+    by wrappers recording call counts, cumulative, max and self time, and a heartbeat timer on the Qt event loop
+    records how long the loop was stalled. When disabled nothing is wrapped, so there is no overhead at all.
+
+    The results are written as a pstats file (pstats.Stats / snakeviz can read it) and as collapsed stacks for
+    flamegraph.pl / speedscope, where a stack is the thread followed by the nested handlers.
+    """
+    logger = logging.getLogger("SlotProfiler")
+
+    # the heartbeat interval, a heartbeat later than STALL_THRESHOLD is recorded as a stall
+    HEARTBEAT_MS = 20
+    STALL_THRESHOLD = 0.05
+
+    def __init__(self):
+        value = os.environ.get(ENV_VAR, '')
+        self.enabled = value not in ('', '0')
+        self.output = DEFAULT_OUTPUT if value in ('', '0', '1') else value
+        self._lock = threading.Lock()
+        # name -> [calls, cumulative, max, self, (file, line)]
+        self._stats = {}
+        # "thread;handler;nested handler" -> self time
+        self._stacks = {}
+        self._local = threading.local()
+        self._stalls = []
+        self._heartbeat = None
+
+    def enable(self, output: str = None):
+        """
+        Enable the profiling, it has to be called before the classes to be profiled are imported
+        """
+        self.enabled = True
+        if output:
+            self.output = output
+
+    def instrument(self, cls, prefixes=('on_', '_on_')):
+        """
+        Wrap the @Slot methods of the class and its methods named with one of the prefixes, a no-op when disabled
+        :return: the class
+        """
+        if not self.enabled:
+            return cls
+        for name, method in list(vars(cls).items()):
+            # signals are named like the handlers, only the plain functions are wrapped
+            if inspect.isfunction(method) and ('_slots' in method.__dict__ or name.startswith(prefixes)):
+                setattr(cls, name, self._wrap(f'{cls.__name__}.{name}', method))
+        return cls
+
+    def _wrap(self, name: str, method):
+        code = method.__code__
+        with self._lock:
+            self._stats[name] = [0, 0.0, 0.0, 0.0, (code.co_filename, code.co_firstlineno)]
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = [[threading.current_thread().name, 0.0]]
+            frame = [name, 0.0]
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                took = time.perf_counter() - start
+                path = ';'.join(entry[0] for entry in stack)
+                stack.pop()
+                stack[-1][1] += took
+                own = took - frame[1]
+                with self._lock:
+                    stats = self._stats[name]
+                    stats[0] += 1
+                    stats[1] += took
+                    stats[2] = max(stats[2], took)
+                    stats[3] += own
+                    self._stacks[path] = self._stacks.get(path, 0.0) + own
+        return wrapper
+
+    def watch_event_loop(self, parent=None):
+        """
+        Start the heartbeat on the calling thread's event loop, a no-op when disabled
+        """
+        if not self.enabled:
+            return
+        from PySide6.QtCore import QTimer
+        self._heartbeat = QTimer(parent)
+        self._heartbeat.setInterval(self.HEARTBEAT_MS)
+        self._last_beat = time.perf_counter()
+
+        def beat():
+            now = time.perf_counter()
+            late = now - self._last_beat - self.HEARTBEAT_MS / 1000
+            self._last_beat = now
+            if late > self.STALL_THRESHOLD:
+                self._stalls.append((now, late))
+
+        self._heartbeat.timeout.connect(beat)
+        self._heartbeat.start()
+
+    def report(self):
+        """
+        Log the slowest handlers and the event loop stalls and write out the pstats and collapsed stack files
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = {name: list(values) for name, values in self._stats.items() if values[0] > 0}
+            stacks = dict(self._stacks)
+        stalls = [late for _, late in self._stalls]
+
+        lines = [f'{"handler":<52}{"calls":>9}{"total s":>10}{"mean ms":>10}{"max ms":>10}']
+        for name, (calls, total, longest, _, _) in sorted(stats.items(), key=lambda s: s[1][1], reverse=True):
+            lines.append(f'{name:<52}{calls:>9}{total:>10.3f}{1000 * total / calls:>10.3f}{1000 * longest:>10.3f}')
+        if stalls:
+            lines.append(f'{len(stalls)} event loop stalls over {1000 * self.STALL_THRESHOLD:.0f}ms, '
+                         f'{sum(stalls):.3f}s in total, longest {1000 * max(stalls):.1f}ms')
+        self.logger.info('Slot profile\n' + '\n'.join(lines))
+
+        # the pstats format: (file, line, function) -> (primitive calls, calls, self time, cumulative time, callers)
+        with open(f'{self.output}.pstats', 'wb') as f:
+            marshal.dump({(location[0], location[1], name): (calls, calls, own, total, {})
+                          for name, (calls, total, _, own, location) in stats.items()}, f)
+        # flamegraph collapsed stacks, in microseconds
+        with open(f'{self.output}.folded', 'w') as f:
+            for path, own in sorted(stacks.items()):
+                f.write(f'{path} {int(own * 1e6)}\n')
+            if stalls:
+                f.write(f'EventLoopStall {int(sum(stalls) * 1e6)}\n')
+        self.logger.info(f'Slot profile written to {self.output}.pstats and {self.output}.folded')
+
+
+profiler = SlotProfiler()
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# taken as the start of the process, main imports this module before anything else
+_PROCESS_START = time.perf_counter()
+
+
+class StartupTimer:
+    """
+    Records how long each phase of the startup takes. Phases may run in parallel on different threads, so each
+    one is recorded with its own start and end relative to the process start.
+    """
+    logger = logging.getLogger("Startup")
+
+    # seconds from the process start until the window is shown
+    WINDOW_TARGET = 0.5
+    # seconds from the process start until both the masters are loaded and shown. Cold start is when the master
+    # files are downloaded, warm start is when today's files are already on disk.
+    COLD_TARGET = 5.0
+    WARM_TARGET = 2.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = []
+        self._marks = {}
+        self.cold = False
+
+    @staticmethod
+    def elapsed() -> float:
+        return time.perf_counter() - _PROCESS_START
+
+    @contextmanager
+    def phase(self, name: str):
+        start = self.elapsed()
+        try:
+            yield
+        finally:
+            end = self.elapsed()
+            with self._lock:
+                self._phases.append((name, start, end, threading.current_thread().name))
+
+    def mark(self, name: str):
+        """
+        Record a point in time, e.g. when the window is shown
+        """
+        with self._lock:
+            self._marks.setdefault(name, self.elapsed())
+
+    def report(self):
+        """
+        Log the time taken by every phase and how the startup compares against the targets
+        """
+        with self._lock:
+            phases = sorted(self._phases, key=lambda p: p[1])
+            marks = sorted(self._marks.items(), key=lambda m: m[1])
+
+        lines = [f'{"phase":<28}{"start":>9}{"took":>9}  thread']
+        lines += [f'{name:<28}{start:>9.3f}{end - start:>9.3f}  {thread}' for name, start, end, thread in phases]
+        lines += [f'{name:<28}{at:>9.3f}' for name, at in marks]
+
+        ready = self._marks.get('ready', self.elapsed())
+        target = self.COLD_TARGET if self.cold else self.WARM_TARGET
+        shown = self._marks.get('window shown')
+        lines.append(f'{"cold" if self.cold else "warm"} start ready in {ready:.3f}s (target {target:.1f}s)'
+                     + (f', window shown in {shown:.3f}s (target {self.WINDOW_TARGET:.1f}s)' if shown else ''))
+        self.logger.info('Startup timing\n' + '\n'.join(lines))
+        if ready > target or (shown is not None and shown > self.WINDOW_TARGET):
+            self.logger.warning('Startup is slower than the target')
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class SymbolIndex:
+    """
+    Sorted symbol array with a prefix and a trigram index for searching. Prefix matches are found with a binary
+    search on the sorted array, substring matches by intersecting the posting lists of the trigrams of the text.
+    """
+
+    def __init__(self, symbols):
+        """
+        :param symbols: the symbols to be indexed, they are kept sorted
+        """
+        self.symbols = np.sort(np.asarray(symbols, dtype=str))
+        self._trigrams = self._build_trigrams(self.symbols)
+
+    def __len__(self):
+        return self.symbols.size
+
+    @staticmethod
+    def _build_trigrams(symbols: np.ndarray) -> dict:
+        postings = {}
+        for position, symbol in enumerate(symbols.tolist()):
+            for trigram in {symbol[i:i + 3] for i in range(len(symbol) - 2)}:
+                rows = postings.get(trigram)
+                if rows is None:
+                    postings[trigram] = rows = []
+                rows.append(position)
+        return {trigram: np.array(rows, dtype=np.int32) for trigram, rows in postings.items()}
+
+    def search(self, text: str) -> np.ndarray:
+        """
+        :param text: the text to search for, case insensitive
+        :return: positions in symbols of the matches, the symbols starting with text first and then the ones
+                 containing it. All the positions if text is empty
+        """
+        text = text.strip().upper()
+        if text == '':
+            return np.arange(self.symbols.size, dtype=np.int32)
+
+        lo = np.searchsorted(self.symbols, text, side='left')
+        hi = np.searchsorted(self.symbols, text + '\uffff', side='left')
+        prefix = np.arange(lo, hi, dtype=np.int32)
+        if len(text) < 3:
+            return prefix
+
+        postings = []
+        for i in range(len(text) - 2):
+            rows = self._trigrams.get(text[i:i + 3])
+            if rows is None:
+                return prefix
+            postings.append(rows)
+        postings.sort(key=len)
+        candidates = postings[0]
+        for rows in postings[1:]:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            if candidates.size == 0:
+                return prefix
+
+        # trigrams may match out of order, confirm that the text is actually in the symbol
+        candidates = candidates[(candidates < lo) | (candidates >= hi)]
+        matches = candidates[np.char.find(self.symbols[candidates], text) >= 0]
+        return np.concatenate((prefix, matches))
+
+    def updated(self, added, removed) -> 'SymbolIndex':
+        """
+        Add and remove symbols. The posting lists of the unchanged symbols are only renumbered, the trigrams are
+        computed just for the added ones. This index is left as it is, so that it can still be searched meanwhile.
+        :param added: the symbols to add, the ones already indexed are ignored
+        :param removed: the symbols to remove
+        :return: a new index with the changes
+        """
+        keep = ~np.isin(self.symbols, np.asarray(removed, dtype=str))
+        added = np.setdiff1d(np.asarray(added, dtype=str), self.symbols)
+        symbols = np.sort(np.concatenate((self.symbols[keep], added)))
+
+        # old position -> new position, -1 for the removed symbols
+        renumber = np.full(self.symbols.size, -1, dtype=np.int32)
+        renumber[keep] = np.searchsorted(symbols, self.symbols[keep])
+        trigrams = {}
+        for trigram, rows in self._trigrams.items():
+            rows = renumber[rows]
+            rows = rows[rows >= 0]
+            if rows.size > 0:
+                trigrams[trigram] = rows
+
+        positions = np.searchsorted(symbols, added)
+        for trigram, rows in self._build_trigrams(added).items():
+            rows = positions[rows].astype(np.int32)
+            existing = trigrams.get(trigram)
+            trigrams[trigram] = rows if existing is None else np.sort(np.concatenate((existing, rows)))
+
+        index = SymbolIndex.__new__(SymbolIndex)
+        index.symbols = symbols
+        index._trigrams = trigrams
+        return index
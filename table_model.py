@@ -1,8 +1,19 @@
-import pandas
-from PySide6.QtCore import Qt, QAbstractTableModel
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import numpy as np
+from PySide6.QtCore import Qt, QAbstractTableModel, QAbstractListModel
 from PySide6.QtGui import QColor
 from PySide6.QtWidgets import QStyledItemDelegate
 
+from bar_aggregator import BarAggregator, sparkline
+from calendar_chain import CalendarChain
+from market_depth import DepthBook, DEPTH_LEVELS, BID, ASK, PRICE, QTY
+from symbol_index import SymbolIndex
+
+if TYPE_CHECKING:
+    import pandas
+
 
 class QHighlightDelegate(QStyledItemDelegate):
     def __init__(self, model):
@@ -27,14 +38,30 @@ class QHighlightDelegate(QStyledItemDelegate):
     def flags(self, index):
         return Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled
 
+def _bars_tooltip(bars: BarAggregator, token: int):
+    change = bars.change(token)
+    if change is None:
+        return None
+    return f'{change:+.2f}%  {sparkline(bars.bars(token, 5).close)}'
+
+
 class OptionChainTableModel(QAbstractTableModel):
     PreviousValueRole = Qt.ItemDataRole.UserRole + 1
 
-    def __init__(self, data:pandas.DataFrame, parent=None):
+    def __init__(self, data: 'pandas.DataFrame', parent=None, bars: BarAggregator = None):
         super(OptionChainTableModel, self).__init__(parent=parent)
         self._data = data
         self.columns = ["CALL Price", "Strike", "PUT Price"]
         self._previous_values = {}
+        self._bars = bars
+        # (row, column) -> (time, oi) of the prices taken from the snapshot, until a live tick replaces them
+        self._stale = {}
+
+    def set_stale(self, cells: dict):
+        """
+        :param cells: (row, column) -> (time, oi) of the last known prices shown
+        """
+        self._stale = dict(cells)
 
     def rowCount(self, parent = ...):
         return len(self._data.values)
@@ -48,6 +75,16 @@ class OptionChainTableModel(QAbstractTableModel):
                 return str(self._data.values[index.row()][index.column()])
             elif role == self.PreviousValueRole:
                 return self._previous_values.get((index.row(), index.column()), "")
+            elif role == Qt.ItemDataRole.ForegroundRole and (index.row(), index.column()) in self._stale:
+                return QColor(Qt.GlobalColor.gray)
+            elif role == Qt.ItemDataRole.ToolTipRole and (index.row(), index.column()) in self._stale:
+                at, oi = self._stale[(index.row(), index.column())]
+                return f'Last known at {datetime.fromtimestamp(at):%d-%b %H:%M:%S}' + \
+                    ('' if np.isnan(oi) else f', OI {oi:,.0f}')
+            elif role == Qt.ItemDataRole.ToolTipRole and self._bars is not None and index.column() != 1:
+                # intraday change and sparkline of the 5 minute closes
+                token_field = 'CE_Token' if index.column() == 0 else 'PE_Token'
+                return _bars_tooltip(self._bars, int(self._data[token_field].values[index.row()]))
         return None
 
     def headerData(self, section, orientation, role = ...):
@@ -59,6 +96,7 @@ class OptionChainTableModel(QAbstractTableModel):
         key = (index.row(), index.column())
         self._previous_values[key] = str(self._data.loc[row, price_field])
         self._data.loc[row, price_field] = price
+        self._stale.pop(key, None)
         self.dataChanged.emit(index, index)
 
     def flags(self, index):
@@ -66,11 +104,12 @@ class OptionChainTableModel(QAbstractTableModel):
 
 
 class PositionsTableModel(QAbstractTableModel):
-    def __init__(self, data: pandas.DataFrame, parent=None):
+    def __init__(self, data: 'pandas.DataFrame', parent=None, bars: BarAggregator = None):
         super(PositionsTableModel, self).__init__(parent=parent)
         self._data = data
         self.columns = ['Name', 'Option', 'Lots', 'Qty', 'Avg Price', 'LTP', 'P/L', 'Return %']
         self._previous_values = {}
+        self._bars = bars
 
     def rowCount(self, parent=...):
         return len(self._data.values)
@@ -84,6 +123,8 @@ class PositionsTableModel(QAbstractTableModel):
                 return str(self._data.values[index.row()][index.column()])
             # elif role == self.PreviousValueRole:
             #     return self._previous_values.get((index.row(), index.column()), "")
+            elif role == Qt.ItemDataRole.ToolTipRole and self._bars is not None and self.columns[index.column()] == 'LTP':
+                return _bars_tooltip(self._bars, int(self._data['Token'].values[index.row()]))
         return None
 
     def headerData(self, section, orientation, role=...):
@@ -98,4 +139,173 @@ class PositionsTableModel(QAbstractTableModel):
         # update P/L
         self._data.loc[row, 'P/L'] = (price - self._data.loc[row, 'Avg Price']) * self._data.loc[row, 'Qty']
         self._data.loc[row, 'Return %'] = 100 * (self._data.loc[row, 'P/L'] / (self._data.loc[row, 'Qty'] * self._data.loc[row, 'Avg Price']))
-        self.dataChanged.emit(self.createIndex(row, 0), self.createIndex(row, self.columnCount() - 1))
\ No newline at end of file
+        self.dataChanged.emit(self.createIndex(row, 0), self.createIndex(row, self.columnCount() - 1))
+
+
+class DepthTableModel(QAbstractTableModel):
+    # column -> (side, price or qty) in the depth book
+    _cells = [(BID, QTY), (BID, PRICE), (ASK, PRICE), (ASK, QTY)]
+
+    def __init__(self, book: DepthBook, token: int, parent=None):
+        super(DepthTableModel, self).__init__(parent=parent)
+        self._book = book
+        self.token = token
+        self.columns = ['Bid Qty', 'Bid', 'Ask', 'Ask Qty']
+
+    def rowCount(self, parent=...):
+        return DEPTH_LEVELS
+
+    def columnCount(self, parent=...):
+        return len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole and self.token in self._book:
+            side, col = self._cells[index.column()]
+            value = self._book.latest(self.token)[side, index.row(), col]
+            return str(int(value)) if col == QTY else str(value)
+        return None
+
+    def headerData(self, section, orientation, role=...):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.columns[section]
+
+    def update_levels(self, changed):
+        """
+        Repaint only the levels which changed
+        :param changed: bool array of shape (2, DEPTH_LEVELS) as returned by DepthBook.update
+        """
+        for level in range(DEPTH_LEVELS):
+            if changed[BID, level]:
+                self.dataChanged.emit(self.createIndex(level, 0), self.createIndex(level, 1))
+            if changed[ASK, level]:
+                self.dataChanged.emit(self.createIndex(level, 2), self.createIndex(level, 3))
+
+
+class SymbolListModel(QAbstractListModel):
+    """
+    List of symbols shown straight from a SymbolIndex, only the rows in view are ever materialised by the view.
+    """
+
+    def __init__(self, index: SymbolIndex = None, parent=None):
+        super(SymbolListModel, self).__init__(parent=parent)
+        self._index = None
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._filter = ''
+        if index is not None:
+            self.set_index(index)
+
+    def set_index(self, index: SymbolIndex):
+        self.beginResetModel()
+        self._index = index
+        self._rows = index.search(self._filter)
+        self.endResetModel()
+
+    def set_filter(self, text: str):
+        self._filter = text
+        if self._index is not None:
+            self.beginResetModel()
+            self._rows = self._index.search(text)
+            self.endResetModel()
+
+    def rowCount(self, parent=...):
+        return self._rows.size
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            return str(self._index.symbols[self._rows[index.row()]])
+        return None
+
+
+class CalendarTableModel(QAbstractTableModel):
+    """
+    [Strike | for each expiry: CE, PE, CE Spread, PE Spread], the columns of the hidden expiries are hidden by the view
+    """
+
+    def __init__(self, calendar: CalendarChain, parent=None):
+        super(CalendarTableModel, self).__init__(parent=parent)
+        self._calendar = calendar
+        self.columns = ["Strike"]
+        for expiry in calendar.expiries:
+            self.columns += [f'{expiry} CE', f'{expiry} PE', 'CE Spread', 'PE Spread']
+
+    def rowCount(self, parent=...):
+        return self._calendar.strikes.size
+
+    def columnCount(self, parent=...):
+        return len(self.columns)
+
+    def _cell(self, column):
+        # column -> (expiry, CE/PE, is spread)
+        expiry, offset = divmod(column - 1, 4)
+        return expiry, offset % 2, offset >= 2
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == 0:
+                return str(self._calendar.strikes[index.row()])
+            expiry, side, is_spread = self._cell(index.column())
+            values = self._calendar.spreads if is_spread else self._calendar.prices
+            value = values[expiry, side, index.row()]
+            return "" if np.isnan(value) else f'{value:.2f}'
+        return None
+
+    def headerData(self, section, orientation, role=...):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.columns[section]
+
+    def is_column_hidden(self, column) -> bool:
+        if column == 0:
+            return False
+        expiry, side, is_spread = self._cell(column)
+        shown = np.flatnonzero(self._calendar.visible)
+        # the nearest visible expiry is what the spreads are taken against
+        return bool(not self._calendar.visible[expiry] or (is_spread and expiry == shown[0]))
+
+    def update_price(self, expiry, side, row):
+        shown = np.flatnonzero(self._calendar.visible)
+        if shown.size > 0 and expiry == shown[0]:
+            # the spreads of every other expiry in the row have changed as well
+            self.dataChanged.emit(self.createIndex(row, 1), self.createIndex(row, self.columnCount() - 1))
+        else:
+            column = 1 + 4 * expiry + side
+            self.dataChanged.emit(self.createIndex(row, column), self.createIndex(row, column))
+            self.dataChanged.emit(self.createIndex(row, column + 2), self.createIndex(row, column + 2))
+
+    def refresh(self):
+        self.dataChanged.emit(self.createIndex(0, 0), self.createIndex(self.rowCount() - 1, self.columnCount() - 1))
+
+
+class ScannerTableModel(QAbstractTableModel):
+    """
+    Scanner results, sorted on the raw values (SortRole) by a QSortFilterProxyModel
+    """
+    SortRole = Qt.ItemDataRole.UserRole + 2
+
+    def __init__(self, data: 'pandas.DataFrame', parent=None):
+        super(ScannerTableModel, self).__init__(parent=parent)
+        self._data = data
+        self.columns = list(data.columns)
+
+    def rowCount(self, parent=...):
+        return len(self._data.index)
+
+    def columnCount(self, parent=...):
+        return len(self.columns)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid():
+            value = self._data.iat[index.row(), index.column()]
+            if role == Qt.ItemDataRole.DisplayRole:
+                if isinstance(value, float):
+                    return "" if np.isnan(value) else f'{value:.2f}'
+                return str(value)
+            elif role == self.SortRole:
+                # NaN sorts after everything else
+                if isinstance(value, float):
+                    return float('inf') if np.isnan(value) else value
+                return str(value)
+        return None
+
+    def headerData(self, section, orientation, role=...):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.columns[section]
@@ -0,0 +1,225 @@
+import logging
+import os
+import queue
+import threading
+from array import array
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+Ticks = namedtuple('Ticks', ['time', 'ltp', 'volume', 'oi'])
+
+# column name -> dtype, each column is an append only file in the day's directory
+_COLUMNS = {'token': np.int64, 'time': np.float64, 'ltp': np.float64, 'volume': np.int64, 'oi': np.int64}
+
+
+class TickStore:
+    """
+    Columnar store of the day's ticks (token, time, ltp, volume, oi) backed by append only memory mapped files,
+    one file per column. Ticks are queued by the caller and written in batches by a background thread. A per token
+    index of row offsets is kept so that a query touches only the rows of that token. When the feed time of a tick
+    crosses midnight, the store rolls over to the directory of the new day.
+    """
+    logger = logging.getLogger("TickStore")
+
+    def __init__(self, day: date = None, directory: str = 'ticks', readonly: bool = False,
+                 capacity: int = 1 << 20):
+        """
+        :param day: the day of the store, today if not given
+        :param directory: the directory under which a directory per day is created
+        :param readonly: open an existing day for queries only
+        :param capacity: the initial number of rows, the files are grown by doubling
+        """
+        self.directory = directory
+        self.readonly = readonly
+        self._initial_capacity = capacity
+        self._lock = threading.Lock()
+        self._open(day or date.today())
+
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        if not readonly:
+            self._writer = threading.Thread(target=self._write_loop, name='TickStoreWriter', daemon=True)
+            self._writer.start()
+
+    def __len__(self):
+        return int(self._count[0])
+
+    def _open(self, day: date):
+        self.day = day
+        self.path = os.path.join(self.directory, str(day))
+        # the epoch time at which the store rolls over to the next day
+        self._day_end = datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+        self._columns = {}
+        if not self.readonly:
+            os.makedirs(self.path, exist_ok=True)
+
+        # the number of rows written is kept in its own small file so that the column files can be preallocated
+        count_file = os.path.join(self.path, 'count.bin')
+        if not os.path.isfile(count_file):
+            if self.readonly:
+                raise FileNotFoundError(f'No tick store at {self.path}')
+            np.zeros(1, dtype=np.int64).tofile(count_file)
+        self._count = np.memmap(count_file, dtype=np.int64, mode='r' if self.readonly else 'r+', shape=(1,))
+        self._capacity = 0
+        self._map_columns(max(self._initial_capacity, int(self._count[0])))
+        self._index = {}
+        # token -> [ltp, volume, oi], the feed sends only changed fields so the last known values are carried forward
+        self._last = {}
+        self._rebuild_index()
+
+    def _roll_over(self, feed_time: float):
+        """
+        Flush the current day and continue in the directory of the day of feed_time
+        """
+        for column in self._columns.values():
+            column.flush()
+        self._count.flush()
+        day = date.fromtimestamp(feed_time)
+        self.logger.info(f'Rolling the tick store over from {self.day} to {day}')
+        previous = self._last
+        with self._lock:
+            self._open(day)
+        # the price and OI continue into the new day, the volume is a day volume and starts again
+        for token, (ltp, _, oi) in previous.items():
+            self._last.setdefault(token, [ltp, 0, oi])
+
+    def _map_columns(self, capacity: int):
+        mode = 'r' if self.readonly else 'r+'
+        for name, dtype in _COLUMNS.items():
+            filename = os.path.join(self.path, f'{name}.bin')
+            if not self.readonly:
+                with open(filename, 'ab') as f:
+                    if f.tell() < capacity * np.dtype(dtype).itemsize:
+                        f.truncate(capacity * np.dtype(dtype).itemsize)
+            column = self._columns.pop(name, None)
+            if column is not None:
+                column.flush()
+                del column
+            self._columns[name] = np.memmap(filename, dtype=dtype, mode=mode,
+                                            shape=(os.path.getsize(filename) // np.dtype(dtype).itemsize,))
+        self._capacity = capacity
+
+    def _rebuild_index(self):
+        count = len(self)
+        if count == 0:
+            return
+        tokens = self._columns['token'][:count]
+        order = np.argsort(tokens, kind='stable')
+        unique, starts = np.unique(tokens[order], return_index=True)
+        columns = self._columns
+        for token, rows in zip(unique.tolist(), np.split(order, starts[1:])):
+            self._index[token] = array('q', rows.tolist())
+            # the store was reopened, the carried forward values continue from the last row of the token
+            row = rows[-1]
+            self._last[token] = [float(columns['ltp'][row]), int(columns['volume'][row]), int(columns['oi'][row])]
+
+    def append(self, token: int, feed_time: float, ltp=None, volume=None, oi=None) -> None:
+        """
+        Queue a tick for writing, safe to call from any thread. The fields which are None are carried forward from
+        the previous tick of the token.
+        """
+        self._queue.put((token, feed_time, ltp, volume, oi))
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 65536:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as exc:
+                    self.logger.error(f'Unable to write {len(batch)} ticks -> {exc}')
+            if stop:
+                return
+
+    def _write(self, batch: list):
+        rows = []
+        for i, (token, feed_time, ltp, volume, oi) in enumerate(batch):
+            if float(feed_time) >= self._day_end:
+                # the ticks of the new day go to its own directory
+                if rows:
+                    self._write_rows(rows)
+                self._roll_over(float(feed_time))
+                self._write(batch[i:])
+                return
+            last = self._last.get(token)
+            if last is None:
+                last = self._last[token] = [0.0, 0, 0]
+            if ltp:
+                last[0] = float(ltp)
+            if volume:
+                last[1] = int(volume)
+            if oi:
+                last[2] = int(oi)
+            rows.append((token, float(feed_time), last[0], last[1], last[2]))
+        self._write_rows(rows)
+
+    def _write_rows(self, rows: list):
+        values = np.array(rows, dtype=np.float64)
+
+        with self._lock:
+            start = len(self)
+            end = start + len(rows)
+            if end > self._capacity:
+                self._map_columns(max(end, self._capacity * 2))
+            for col, name in enumerate(_COLUMNS):
+                self._columns[name][start:end] = values[:, col]
+
+            tokens = self._columns['token'][start:end]
+            order = np.argsort(tokens, kind='stable')
+            unique, starts = np.unique(tokens[order], return_index=True)
+            for token, offsets in zip(unique.tolist(), np.split(order + start, starts[1:])):
+                index = self._index.get(token)
+                if index is None:
+                    index = self._index[token] = array('q')
+                index.extend(offsets.tolist())
+            self._count[0] = end
+
+    def tokens(self) -> list:
+        with self._lock:
+            return list(self._index)
+
+    def query(self, token: int, start: float = None, end: float = None) -> Ticks:
+        """
+        :param token: the token to query
+        :param start: epoch time from which the ticks are returned, from the first tick if None
+        :param end: epoch time before which the ticks are returned, till the last tick if None
+        :return: the ticks of the token in the window, oldest first
+        """
+        with self._lock:
+            index = self._index.get(token)
+            rows = np.frombuffer(index, dtype=np.int64).copy() if index is not None else np.zeros(0, np.int64)
+            times = self._columns['time'][rows]
+            # the ticks of a token are written in feed order, so the window is a contiguous range of its rows
+            lo = 0 if start is None else np.searchsorted(times, start, side='left')
+            hi = times.size if end is None else np.searchsorted(times, end, side='left')
+            rows = rows[lo:hi]
+            return Ticks(times[lo:hi], self._columns['ltp'][rows], self._columns['volume'][rows],
+                         self._columns['oi'][rows])
+
+    def flush(self):
+        with self._lock:
+            for column in self._columns.values():
+                column.flush()
+            self._count.flush()
+
+    def close(self):
+        """
+        Write the queued ticks and flush the files
+        """
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        if not self.readonly:
+            self.flush()